@@ -0,0 +1,14 @@
+"""Load faster-whisper-english.py as a module for the command-line tools.
+
+The app's file name has a hyphen, so it cannot be imported by name.
+"""
+import importlib.util
+from pathlib import Path
+
+
+def load_app(file_name="faster-whisper-english.py"):
+    path = Path(__file__).parent / file_name
+    spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,965 @@
+"""Parts shared by the Streamlit apps (faster-whisper-english.py,
+whisper-english.py and whisper_pronounce.py).
+
+Recording (AudioBuffer, FrameRecorder and the helpers around them), the
+transcription scheduler, word scoring and the model registry live here
+once; each app imports what it uses and keeps its own page and settings.
+"""
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+import wave
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+import av
+import numpy as np
+import streamlit as st
+
+class Metrics:
+    """Timing spans and counters, forwarded to every configured sink."""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def _emit(self, record):
+        for sink in self.sinks:
+            sink.emit(record)
+
+    def observe(self, name, seconds, **labels):
+        self._emit({"type": "span", "name": name, "seconds": seconds, "ts": time.time(), **labels})
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def count(self, name, value=1, **labels):
+        self._emit({"type": "counter", "name": name, "value": value, "ts": time.time(), **labels})
+
+NULL_METRICS = Metrics()
+
+# 画面更新の上限 (回/秒)。録音中の状態表示・レベルメーター・途中結果はこれ以上頻繁に送らない。0 で無制限
+UI_MAX_FPS = float(os.environ.get("ASR_UI_MAX_FPS", "4"))
+
+class ThrottledUpdater:
+    """Rate-limited, coalescing writer for one st.empty() placeholder.
+
+    `update()` records the latest value (a placeholder method name and its
+    arguments). It is sent only when it differs from what the browser
+    already shows and at least 1 / max_fps seconds have passed since the
+    last send; otherwise it waits for the next `update()` or `flush()`, and
+    newer values replace it.
+    """
+
+    def __init__(self, placeholder, max_fps=UI_MAX_FPS):
+        self.placeholder = placeholder
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.requested = 0
+        self.sent = 0
+        self._shown = None
+        self._pending = None
+        self._sent_at = float("-inf")
+
+    def update(self, kind, *args, **kwargs):
+        """Show `placeholder.<kind>(*args, **kwargs)` once the rate limit allows."""
+        self.requested += 1
+        value = (kind, args, tuple(sorted(kwargs.items())))
+        if value == self._shown:
+            self._pending = None
+            return
+        self._pending = value
+        if time.monotonic() - self._sent_at >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """Send the pending value now, if any."""
+        if self._pending is None:
+            return
+        kind, args, kwargs = self._pending
+        getattr(self.placeholder, kind)(*args, **dict(kwargs))
+        self._shown, self._pending = self._pending, None
+        self._sent_at = time.monotonic()
+        self.sent += 1
+
+    def report(self, metrics, **labels):
+        metrics.count("ui_updates", self.requested, state="requested", **labels)
+        metrics.count("ui_updates", self.sent, state="sent", **labels)
+
+WHISPER_SAMPLE_RATE = 16000
+
+def frame_to_array(audio_frame):
+    """View of an av.AudioFrame as a (samples, channels) array, without copying."""
+    array = audio_frame.to_ndarray()
+    if audio_frame.format.is_planar:
+        # (channels, samples) -> (samples, channels)
+        return array.T
+    # interleaved (1, samples * channels) -> (samples, channels)
+    return array.reshape(-1, len(audio_frame.layout.channels))
+
+def to_whisper_audio(samples, sample_rate):
+    """Convert (samples, channels) int PCM to 16kHz mono float32 for Whisper."""
+    scale = float(np.iinfo(samples.dtype).max + 1)
+    mono = samples.mean(axis=1, dtype=np.float32) / scale
+    if sample_rate == WHISPER_SAMPLE_RATE:
+        return mono
+    frame = av.AudioFrame.from_ndarray(mono.reshape(1, -1), format="flt", layout="mono")
+    frame.sample_rate = sample_rate
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=WHISPER_SAMPLE_RATE)
+    out_frames = resampler.resample(frame) + resampler.resample(None)
+    if not out_frames:
+        return np.empty(0, dtype=np.float32)
+    return np.concatenate([f.to_ndarray().reshape(-1) for f in out_frames])
+
+def write_wav(file_path, samples, sample_rate):
+    with wave.open(str(file_path), "wb") as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(samples.dtype.itemsize)
+        w.setframerate(sample_rate)
+        w.writeframes(np.ascontiguousarray(samples))
+
+# 保存形式: 名前 -> (PyAV のエンコーダ, 拡張子, MIME)。wav はエンコードせずそのまま書く
+STORAGE_FORMATS = {
+    "wav": (None, ".wav", "audio/wav"),
+    "flac": ("flac", ".flac", "audio/flac"),
+    "opus": ("libopus", ".ogg", "audio/ogg"),
+}
+
+def write_audio(file_path, samples, sample_rate, encoder):
+    """Encode (samples, channels) s16 PCM to `file_path`; the container follows the extension."""
+    layout = "mono" if samples.shape[1] == 1 else "stereo"
+    frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(samples).reshape(1, -1), format="s16", layout=layout)
+    frame.sample_rate = sample_rate
+    with av.open(str(file_path), "w") as container:
+        stream = container.add_stream(encoder, rate=sample_rate, layout=layout)
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+def stored_audio_path(wav_file_path):
+    """The take as it is stored: the newest of `wav_file_path` in any storage format."""
+    candidates = [wav_file_path.with_suffix(suffix) for _, suffix, _ in STORAGE_FORMATS.values()]
+    existing = [path for path in candidates if path.exists()]
+    if not existing:
+        return wav_file_path
+    return max(existing, key=lambda path: path.stat().st_mtime)
+
+# 無音カット (前後のみ)。ASR_TRIM_PAD_MS=-1 で無効
+TRIM_PAD_MS = int(os.environ.get("ASR_TRIM_PAD_MS", "250"))
+TRIM_THRESHOLD_DB = float(os.environ.get("ASR_TRIM_THRESHOLD_DB", "-45"))
+
+def find_speech_bounds(samples, sample_rate, threshold_db=TRIM_THRESHOLD_DB, pad_ms=TRIM_PAD_MS,
+                       window_ms=20, relative_db=-35.0):
+    """Sample range [start, end) of `samples` without leading/trailing silence.
+
+    RMS level is computed per `window_ms` window in one pass; a window counts as
+    voiced when it is above `threshold_db` (dBFS) and within `relative_db` of
+    the loudest window. `pad_ms` of audio is kept on both sides of the voice.
+    Returns (0, len(samples)) when nothing is voiced, so a quiet take is kept.
+    """
+    n = len(samples)
+    window = max(1, sample_rate * window_ms // 1000)
+    num_windows = n // window
+    if pad_ms < 0 or num_windows == 0:
+        return 0, n
+
+    scale = float(np.iinfo(samples.dtype).max + 1)
+    windows = samples[:num_windows * window].reshape(num_windows, -1)
+    power = np.square(windows, dtype=np.float32).mean(axis=1) / (scale * scale)
+    level_db = 10 * np.log10(np.maximum(power, 1e-12))
+    threshold = max(threshold_db, level_db.max() + relative_db)
+    voiced = np.flatnonzero(level_db > threshold)
+    if len(voiced) == 0:
+        return 0, n
+
+    pad = sample_rate * pad_ms // 1000
+    start = max(int(voiced[0]) * window - pad, 0)
+    end = min((int(voiced[-1]) + 1) * window + pad, n)
+    return start, end
+
+# 1 テイクをメモリに置く上限。超えたらテイクごと一時ファイル (memmap) に移す
+BUFFER_RAM_BYTES = int(float(os.environ.get("ASR_BUFFER_RAM_MB", "4")) * 1024 * 1024)
+# 1 テイクの最大長。超えた分のフレームは捨てる (マイクを付けっぱなしのタブ対策)
+MAX_TAKE_SECONDS = float(os.environ.get("ASR_MAX_TAKE_SECONDS", "300"))
+# memmap の置き場所 (None: tempfile の既定)
+BUFFER_SPILL_DIR = os.environ.get("ASR_BUFFER_SPILL_DIR")
+
+class AudioBuffer:
+    """Growable NumPy buffer for the PCM frames of one take.
+
+    Frames are written in place and capacity doubles when full, so appending
+    is amortized O(1). Conversion to WAV / AudioSegment happens only on export.
+
+    With `target_rate`, every frame is downmixed to mono and resampled by a
+    stateful resampler as it arrives, so the take is stored in that format.
+
+    Once the capacity would pass `ram_budget` bytes, the take moves to a
+    memory-mapped, already unlinked temp file in `spill_dir`, so the OS can
+    page it out. Samples past `max_seconds` are dropped and `truncated` is set.
+    """
+
+    def __init__(self, initial_seconds=10, target_rate=None, ram_budget=None, max_seconds=None, tracker=None,
+                 spill_dir=BUFFER_SPILL_DIR):
+        self.initial_seconds = initial_seconds
+        self.target_rate = target_rate
+        self.ram_budget = ram_budget
+        self.max_seconds = max_seconds
+        self.spill_dir = spill_dir
+        self.sample_rate = None
+        self.channels = None
+        self.truncated = False
+        self._data = None  # shape: (capacity, channels)
+        self._length = 0
+        self._resampler = None
+        self._spill_file = None
+        if tracker is not None:
+            tracker.register(self)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return 0.0
+        return self._length / self.sample_rate
+
+    @property
+    def nbytes(self):
+        return 0 if self._data is None else self._data.nbytes
+
+    @property
+    def spilled(self):
+        return self._spill_file is not None
+
+    @property
+    def ram_bytes(self):
+        return 0 if self.spilled else self.nbytes
+
+    @property
+    def disk_bytes(self):
+        # the file is sparse: only the written part takes disk space
+        return self.samples.nbytes if self.spilled else 0
+
+    @property
+    def max_samples(self):
+        if self.max_seconds is None or not self.sample_rate:
+            return None
+        return int(self.max_seconds * self.sample_rate)
+
+    @property
+    def samples(self):
+        if self._data is None:
+            return np.empty((0, self.channels or 1), dtype=np.int16)
+        return self._data[:self._length]
+
+    def _reserve(self, n):
+        needed = self._length + n
+        capacity = len(self._data)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._resize(capacity)
+
+    def _resize(self, capacity):
+        old_data, old_file = self._data, self._spill_file
+        max_samples = self.max_samples
+        if max_samples is not None:
+            capacity = min(capacity, max_samples)
+        nbytes = capacity * self.channels * old_data.dtype.itemsize
+        if old_file is None and (self.ram_budget is None or nbytes <= self.ram_budget):
+            data = np.empty((capacity, self.channels), dtype=old_data.dtype)
+        else:
+            if max_samples is not None:
+                # sparse, so sizing it for the longest take costs nothing and it never has to grow again
+                capacity = max_samples
+            self._spill_file = tempfile.TemporaryFile(prefix="asr-take-", dir=self.spill_dir)
+            data = np.memmap(self._spill_file, dtype=old_data.dtype, mode="w+", shape=(capacity, self.channels))
+        data[:self._length] = old_data[:self._length]
+        self._data = data
+        if old_file is not None:
+            # the old mapping stays valid for as long as a view of it is alive
+            old_file.close()
+
+    def _append(self, array, sample_rate):
+        channels = array.shape[1]
+
+        if self._data is None:
+            self.sample_rate = sample_rate
+            self.channels = channels
+            self._data = np.empty((0, channels), dtype=array.dtype)
+            self._resize(max(self.sample_rate * self.initial_seconds, len(array)))
+        elif sample_rate != self.sample_rate or channels != self.channels:
+            raise ValueError(
+                f"frame format changed: {sample_rate}Hz/{channels}ch "
+                f"(buffer is {self.sample_rate}Hz/{self.channels}ch)"
+            )
+
+        n = len(array)
+        max_samples = self.max_samples
+        if max_samples is not None and self._length + n > max_samples:
+            n = max_samples - self._length
+            array = array[:n]
+            self.truncated = True
+            if n <= 0:
+                return
+        self._reserve(n)
+        self._data[self._length:self._length + n] = array
+        self._length += n
+
+    def _resample(self, audio_frame):
+        array = frame_to_array(audio_frame)
+        if array.shape[1] > 1:
+            # average the channels; libswresample's downmix would add them at -3dB and can clip
+            array = array.mean(axis=1).astype(array.dtype)
+        fmt = audio_frame.format.packed.name
+        mono = av.AudioFrame.from_ndarray(array.reshape(1, -1), format=fmt, layout="mono")
+        mono.sample_rate = audio_frame.sample_rate
+        if self._resampler is None:
+            self._resampler = av.AudioResampler(format=fmt, layout="mono", rate=self.target_rate)
+        return [frame_to_array(f) for f in self._resampler.resample(mono)]
+
+    def append_frame(self, audio_frame):
+        """Store one frame; returns the (samples, channels) array that was stored for it."""
+        if self.target_rate is None:
+            array = frame_to_array(audio_frame)
+            self._append(array, audio_frame.sample_rate)
+            return array
+
+        arrays = self._resample(audio_frame)
+        for array in arrays:
+            self._append(array, self.target_rate)
+        if len(arrays) == 1:
+            return arrays[0]
+        if not arrays:
+            return np.empty((0, 1), dtype=np.int16)
+        return np.concatenate(arrays)
+
+    def flush(self):
+        """Store the samples still held back by the resampler. Call when the take ends."""
+        if self._resampler is None:
+            return
+        for out in self._resampler.resample(None):
+            self._append(frame_to_array(out), self.target_rate)
+        self._resampler = None
+
+    def clear(self):
+        self._data = None
+        self._length = 0
+        self.sample_rate = None
+        self.channels = None
+        self.truncated = False
+        self._resampler = None
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def crop(self, start, end):
+        """Keep only samples [start, end) of the take (a view, nothing is copied)."""
+        self._data = self.samples[start:end]
+        self._length = len(self._data)
+
+    def export_wav(self, file_path):
+        write_wav(file_path, self.samples, self.sample_rate)
+
+    def to_audio_segment(self):
+        import pydub  # only needed for this conversion
+        return pydub.AudioSegment(
+            data=self.samples.tobytes(),
+            sample_width=self._data.dtype.itemsize,
+            frame_rate=self.sample_rate,
+            channels=self.channels,
+        )
+
+class RecordingMemory:
+    """Server-wide totals of the recording buffers of all sessions, for capacity planning.
+
+    Buffers register themselves and are held weakly, so a closed session
+    drops out without having to unregister. A finished take is unregistered
+    by FrameRecorder.take(), so only the buffers being recorded into count.
+    """
+
+    def __init__(self):
+        self._buffers = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def register(self, audio_buffer):
+        with self._lock:
+            self._buffers.add(audio_buffer)
+
+    def unregister(self, audio_buffer):
+        with self._lock:
+            self._buffers.discard(audio_buffer)
+
+    def stats(self):
+        with self._lock:
+            buffers = list(self._buffers)
+        return {
+            "buffers": len(buffers),
+            "recording": sum(1 for b in buffers if len(b) > 0),
+            "spilled": sum(1 for b in buffers if b.spilled),
+            "truncated": sum(1 for b in buffers if b.truncated),
+            "ram_bytes": sum(b.ram_bytes for b in buffers),
+            "disk_bytes": sum(b.disk_bytes for b in buffers),
+        }
+
+@st.cache_resource
+def get_recording_memory():
+    return RecordingMemory()
+
+def recording_memory_sidebar(tracker, max_take_seconds=MAX_TAKE_SECONDS):
+    stats = tracker.stats()
+    st.sidebar.subheader("Recording buffers")
+    st.sidebar.caption(
+        f"sessions {stats['buffers']} / recording {stats['recording']} / "
+        f"RAM {stats['ram_bytes'] / 2**20:.1f}MiB / disk {stats['disk_bytes'] / 2**20:.1f}MiB "
+        f"({stats['spilled']} spilled, {stats['truncated']} at the {max_take_seconds:.0f}s limit)"
+    )
+
+class FrameRecorder:
+    """Session-scoped audio sink, filled from the WebRTC event loop.
+
+    streamlit-webrtc calls `on_frame` for every received frame, so nothing is
+    dropped while the Streamlit script thread is busy; the script thread only
+    reads the status and collects the finished take with `take()`.
+
+    `on_frame` runs on aiortc's event loop, so it only queues the frame.
+    Resampling, storing and feeding the streaming transcriber (if one is set)
+    happen on a short-lived drain thread, which exits once no frame came for
+    a second. The keyword arguments other than `metrics` go to AudioBuffer.
+    """
+
+    DRAIN_LINGER_SECONDS = 1.0
+
+    def __init__(self, metrics=NULL_METRICS, **buffer_options):
+        self.metrics = metrics
+        self.buffer_options = buffer_options
+        self.buffer = AudioBuffer(**buffer_options)
+        self.streaming_transcriber = None
+        self.frames = 0
+        self.track_ended = False
+        self._playing = False
+        self._append_seconds = 0.0
+        self._lock = threading.Lock()  # guards the buffer
+        self._inbox = deque()
+        self._inbox_changed = threading.Condition()
+        self._draining = False  # a drain thread is alive
+        self._storing = 0  # frames taken off the inbox but not stored yet
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def duration(self):
+        return self.buffer.duration
+
+    def on_frame(self, audio_frame):
+        with self._inbox_changed:
+            self._inbox.append(audio_frame)
+            self._inbox_changed.notify_all()
+            if not self._draining:
+                self._draining = True
+                threading.Thread(target=self._drain, name="frame-recorder", daemon=True).start()
+
+    def _drain(self):
+        try:
+            while True:
+                with self._inbox_changed:
+                    if not self._inbox:
+                        self._inbox_changed.wait(self.DRAIN_LINGER_SECONDS)
+                    if not self._inbox:
+                        return
+                    frames = list(self._inbox)
+                    self._inbox.clear()
+                    self._storing = len(frames)
+                try:
+                    for audio_frame in frames:
+                        # 壊れたフレーム 1 つで録音全体を止めない
+                        try:
+                            self._store(audio_frame)
+                        except Exception as e:
+                            print(f"FrameRecorder: dropped a frame: {e!r}")
+                finally:
+                    with self._inbox_changed:
+                        self._storing = 0
+                        self._inbox_changed.notify_all()
+        finally:
+            # 例外で抜けても、次の on_frame が新しい drain スレッドを起こせるようにする
+            with self._inbox_changed:
+                self._draining = False
+                self._inbox_changed.notify_all()
+
+    def _store(self, audio_frame):
+        start = time.perf_counter()
+        with self._lock:
+            # 16kHz mono に変換して保存される
+            stored = self.buffer.append_frame(audio_frame)
+            sample_rate = self.buffer.sample_rate
+            self.frames += 1
+            self._append_seconds += time.perf_counter() - start
+            streaming_transcriber = self.streaming_transcriber
+        if streaming_transcriber is not None and len(stored) > 0 and not self.buffer.truncated:
+            streaming_transcriber.feed(stored, sample_rate)
+
+    def wait_stored(self):
+        """Block until every frame received so far is in the buffer."""
+        with self._inbox_changed:
+            while self._inbox or self._storing:
+                self._inbox_changed.wait()
+
+    def on_ended(self):
+        self.track_ended = True
+
+    def set_playing(self, playing):
+        """Called with the WebRTC state on every run; a new playback forgets the previous track's end."""
+        if playing and not self._playing:
+            self.track_ended = False
+        self._playing = playing
+
+    def level_db(self, seconds=0.1):
+        """RMS level of the last `seconds` of the take in dBFS.
+
+        Reads without the lock, so the script thread never waits for the
+        drain thread: `samples` is a view that stays valid if the buffer
+        grows meanwhile, and at worst misses the newest frame.
+        """
+        sample_rate = self.buffer.sample_rate
+        if not sample_rate:
+            return -120.0
+        tail = self.buffer.samples[-int(sample_rate * seconds):]
+        scale = float(np.iinfo(tail.dtype).max + 1)
+        power = np.square(tail, dtype=np.float32).mean() / (scale * scale) if len(tail) else 0.0
+        return 10 * float(np.log10(max(power, 1e-12)))
+
+    def take(self):
+        """Finish the take: returns (AudioBuffer, streaming_transcriber) and starts a fresh buffer."""
+        self.wait_stored()
+        with self._lock:
+            audio_buffer = self.buffer
+            audio_buffer.flush()
+            streaming_transcriber = self.streaming_transcriber
+            self.metrics.count("frames_received", self.frames)
+            self.metrics.observe("buffer_append", self._append_seconds)
+            if audio_buffer.spilled:
+                self.metrics.count("buffer_spilled")
+            if audio_buffer.truncated:
+                self.metrics.count("take_truncated")
+            self.buffer = AudioBuffer(**self.buffer_options)
+            self.streaming_transcriber = None
+            self.frames = 0
+            self._append_seconds = 0.0
+        tracker = self.buffer_options.get("tracker")
+        if tracker is not None:
+            tracker.unregister(audio_buffer)
+        return audio_buffer, streaming_transcriber
+
+def trim_take(audio_buffer, threshold_db=TRIM_THRESHOLD_DB, pad_ms=TRIM_PAD_MS):
+    """Cut leading/trailing silence of a finished take in place and report it."""
+    total = len(audio_buffer)
+    if total == 0:
+        return
+    start, end = find_speech_bounds(
+        audio_buffer.samples, audio_buffer.sample_rate, threshold_db=threshold_db, pad_ms=pad_ms)
+    lead, tail = start / audio_buffer.sample_rate, (total - end) / audio_buffer.sample_rate
+    audio_buffer.crop(start, end)
+    print(f"trimmed silence: lead {lead:.2f}s tail {tail:.2f}s -> {audio_buffer.duration:.2f}s")
+    st.caption(f"無音カット：先頭 {lead:.2f}s / 末尾 {tail:.2f}s (残り {audio_buffer.duration:.2f}s)")
+
+ASR_WORKERS = int(os.environ.get("ASR_WORKERS", "2"))
+ASR_QUEUE_DEPTH = int(os.environ.get("ASR_QUEUE_DEPTH", "8"))
+
+class SchedulerBusy(Exception):
+    pass
+
+@dataclass
+class TranscriptionJob:
+    job_id: int
+    fn: Callable
+    args: tuple
+    status: str = "queued"  # queued / running / done / failed / cancelled
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_requested: bool = False
+    done_event: threading.Event = field(default_factory=threading.Event)
+    _callbacks: list = field(default_factory=list, repr=False)
+    _callback_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def queue_seconds(self):
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_seconds(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def cancel(self):
+        # a running decode cannot be interrupted; its result is discarded instead
+        self.cancel_requested = True
+        return self.status == "queued"
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+    def add_done_callback(self, fn):
+        """Call fn(job) when the job finishes, on the worker thread (right away if it already has)."""
+        with self._callback_lock:
+            if not self.done_event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set_done(self):
+        with self._callback_lock:
+            self.done_event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"TranscriptionJob: callback for job {self.job_id} failed: {e!r}")
+
+class TranscriptionScheduler:
+    """Bounded worker pool shared by every session for CPU-bound decodes.
+
+    `submit()` raises SchedulerBusy when `max_queue` jobs are already waiting,
+    so callers can show "busy" instead of piling more work onto the host.
+    """
+
+    def __init__(self, num_workers=ASR_WORKERS, max_queue=ASR_QUEUE_DEPTH, history=200):
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._running = 0
+        self.counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+        self._queue_seconds = deque(maxlen=history)
+        self._run_seconds = deque(maxlen=history)
+        for i in range(num_workers):
+            threading.Thread(target=self._worker, name=f"asr-worker-{i}", daemon=True).start()
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._next_id += 1
+            job = TranscriptionJob(self._next_id, fn, args)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.counts["rejected"] += 1
+            raise SchedulerBusy(f"{self._queue.qsize()} jobs already waiting")
+        with self._lock:
+            self.counts["submitted"] += 1
+        return job
+
+    def _finish(self, job, status):
+        job.finished_at = time.perf_counter()
+        job.status = status
+        with self._lock:
+            self.counts[status] += 1
+            if job.queue_seconds is not None:
+                self._queue_seconds.append(job.queue_seconds)
+            if job.run_seconds is not None:
+                self._run_seconds.append(job.run_seconds)
+        job._set_done()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.cancel_requested:
+                self._finish(job, "cancelled")
+                continue
+
+            job.started_at = time.perf_counter()
+            job.status = "running"
+            with self._lock:
+                self._running += 1
+            try:
+                job.result = job.fn(*job.args)
+                status = "cancelled" if job.cancel_requested else "done"
+            except Exception as e:
+                job.error = repr(e)
+                status = "failed"
+                print(f"TranscriptionScheduler: job {job.job_id} failed: {e!r}")
+            finally:
+                with self._lock:
+                    self._running -= 1
+            self._finish(job, status)
+
+    @staticmethod
+    def _percentile(values, p):
+        if not values:
+            return None
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 2)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "running": self._running,
+                **self.counts,
+                "queue_p50": self._percentile(self._queue_seconds, 50),
+                "queue_p95": self._percentile(self._queue_seconds, 95),
+                "run_p50": self._percentile(self._run_seconds, 50),
+                "run_p95": self._percentile(self._run_seconds, 95),
+            }
+
+@st.cache_resource
+def get_transcription_scheduler():
+    return TranscriptionScheduler()
+
+def transcription_queue_sidebar(scheduler):
+    stats = scheduler.stats()
+    st.sidebar.subheader("Transcription queue")
+    st.sidebar.caption(
+        f"queued {stats['queued']} / running {stats['running']} / "
+        f"done {stats['done']} / failed {stats['failed']} / rejected {stats['rejected']}"
+    )
+    if stats["run_p50"] is not None:
+        st.sidebar.caption(
+            f"wait p50 {stats['queue_p50']}s p95 {stats['queue_p95']}s, "
+            f"run p50 {stats['run_p50']}s p95 {stats['run_p95']}s"
+        )
+
+def normalize_words(text):
+    """Lower-case words without punctuation: ' The cat sat.' -> ['the', 'cat', 'sat']."""
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("’", "'")
+    text = re.sub(r"[^\w\s']", " ", text)
+    return [word.strip("'") for word in text.split() if word.strip("'")]
+
+@dataclass
+class WordScore:
+    reference: list
+    hypothesis: list
+    ops: list = field(default_factory=list)  # (op, reference word, hypothesis word); op: hit/sub/del/ins
+
+    def _count(self, op):
+        return sum(1 for o, _, _ in self.ops if o == op)
+
+    @property
+    def hits(self):
+        return self._count("hit")
+
+    @property
+    def substitutions(self):
+        return self._count("sub")
+
+    @property
+    def deletions(self):
+        return self._count("del")
+
+    @property
+    def insertions(self):
+        return self._count("ins")
+
+    @property
+    def errors(self):
+        return len(self.ops) - self.hits
+
+    @property
+    def wer(self):
+        return self.errors / max(len(self.reference), 1)
+
+    @property
+    def correct(self):
+        return self.errors == 0
+
+    def to_markdown(self):
+        marks = []
+        for op, ref, hyp in self.ops:
+            if op == "hit":
+                marks.append(ref)
+            elif op == "sub":
+                marks.append(f":red[~~{ref}~~ {hyp}]")
+            elif op == "del":
+                marks.append(f":red[~~{ref}~~]")
+            else:
+                marks.append(f":orange[+{hyp}]")
+        return " ".join(marks)
+
+def _edit_distance_tables(ref_ids, hyp_ids):
+    """Levenshtein DP tables for a batch of id sequences, padded to (N, R) / (N, H).
+
+    Pads are negative and different in ref and hyp, so they never match.
+    Each reference row is computed for every pair at once; the insertion
+    recurrence cur[j] = min(cur[j], cur[j-1] + 1) is a running minimum of
+    cur[j] - j, so the whole row is a few NumPy calls.
+    """
+    n, num_ref = ref_ids.shape
+    num_hyp = hyp_ids.shape[1]
+    cols = np.arange(num_hyp + 1, dtype=np.int32)
+    tables = np.empty((n, num_ref + 1, num_hyp + 1), dtype=np.int32)
+    tables[:, 0] = cols
+    for i in range(1, num_ref + 1):
+        prev = tables[:, i - 1]
+        cur = np.empty_like(prev)
+        cur[:, 0] = i
+        mismatch = (hyp_ids != ref_ids[:, i - 1:i]).astype(np.int32)
+        cur[:, 1:] = np.minimum(prev[:, :-1] + mismatch, prev[:, 1:] + 1)
+        tables[:, i] = np.minimum.accumulate(cur - cols, axis=1) + cols
+    return tables
+
+def _backtrace(table, reference, hypothesis):
+    # among equally cheap paths prefer hits, then deletions / insertions, then substitutions
+    i, j = len(reference), len(hypothesis)
+    ops = []
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and reference[i - 1] == hypothesis[j - 1] and table[i, j] == table[i - 1, j - 1]:
+            ops.append(("hit", reference[i - 1], hypothesis[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and table[i, j] == table[i - 1, j] + 1:
+            ops.append(("del", reference[i - 1], None))
+            i -= 1
+        elif j > 0 and table[i, j] == table[i, j - 1] + 1:
+            ops.append(("ins", None, hypothesis[j - 1]))
+            j -= 1
+        else:
+            ops.append(("sub", reference[i - 1], hypothesis[j - 1]))
+            i, j = i - 1, j - 1
+    ops.reverse()
+    return ops
+
+def score_pairs(scripts, transcripts):
+    """Word-level alignment of every (script, transcript) pair, computed as one batch."""
+    references = [normalize_words(s) for s in scripts]
+    hypotheses = [normalize_words(t) for t in transcripts]
+    if not references:
+        return []
+
+    vocab = {}
+    def to_ids(words_list, pad):
+        ids = np.full((len(words_list), max(1, max(len(w) for w in words_list))), pad, dtype=np.int32)
+        for row, words in enumerate(words_list):
+            ids[row, :len(words)] = [vocab.setdefault(word, len(vocab)) for word in words]
+        return ids
+
+    tables = _edit_distance_tables(to_ids(references, -1), to_ids(hypotheses, -2))
+    return [
+        WordScore(ref, hyp, _backtrace(table, ref, hyp))
+        for table, ref, hyp in zip(tables, references, hypotheses)
+    ]
+
+def score_questions(questions):
+    """Score every Question that has a transcript; returns {script_index: WordScore}."""
+    answered = [q for q in questions if q.transcript]
+    scores = score_pairs([q.script for q in answered], [q.transcript for q in answered])
+    return {q.script_index: score for q, score in zip(answered, scores)}
+
+def corpus_wer(scores):
+    errors = sum(score.errors for score in scores)
+    words = sum(len(score.reference) for score in scores)
+    return errors / max(words, 1)
+
+ASR_MODEL_MEMORY_LIMIT = int(os.environ.get("ASR_MODEL_MEMORY_MB", "2048")) * 1024 * 1024
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # peak, not current, but the best we have without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@dataclass
+class LoadedModel:
+    key: tuple
+    model: object
+    load_seconds: float
+    resident_bytes: int
+
+class ModelRegistry:
+    """Process-wide cache of loaded ASR models, shared by every session.
+
+    Models are loaded lazily on first request; concurrent requests for the same
+    key wait for a single load. When the summed resident size exceeds
+    `max_bytes`, the least recently used models are dropped.
+    """
+
+    def __init__(self, loader, max_bytes=ASR_MODEL_MEMORY_LIMIT, metrics=NULL_METRICS):
+        self._loader = loader
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._load_locks = {}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, None
+            return None, self._load_locks.setdefault(key, threading.Lock())
+
+    def get(self, model_size, device="cpu", compute_type="int8"):
+        key = (model_size, device, compute_type)
+        entry, load_lock = self._lookup(key)
+        if entry is not None:
+            return entry.model
+
+        with load_lock:
+            entry, _ = self._lookup(key)
+            if entry is not None:
+                return entry.model
+
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            model = self._loader(model_size, device, compute_type)
+            load_seconds = time.perf_counter() - start
+            # approximate when several models load at once
+            resident_bytes = max(current_rss_bytes() - rss_before, 0)
+            print(f"ModelRegistry: loaded {key} in {load_seconds:.2f}s (+{resident_bytes / 2**20:.0f} MiB)")
+            self.metrics.observe("model_load", load_seconds, model="/".join(key))
+
+            with self._lock:
+                self._entries[key] = LoadedModel(key, model, load_seconds, resident_bytes)
+                self._load_locks.pop(key, None)
+                self._evict()
+        return model
+
+    def _evict(self):
+        # the newest entry is at the end and is never evicted
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            print(f"ModelRegistry: evicted {key} ({entry.resident_bytes / 2**20:.0f} MiB)")
+            self.metrics.count("model_evictions", model="/".join(key))
+
+    @property
+    def total_bytes(self):
+        return sum(entry.resident_bytes for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "model": "/".join(entry.key),
+                    "load_seconds": round(entry.load_seconds, 2),
+                    "resident_mb": round(entry.resident_bytes / 2**20),
+                }
+                for entry in self._entries.values()
+            ]
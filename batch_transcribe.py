@@ -0,0 +1,199 @@
+"""Re-transcribe and re-grade a recordings directory offline.
+
+Finds every take under the directory: the entries of each meta.json (as
+written by export_record_info_as_json, or the app's record_info) plus any
+other audio file, which is then transcribed without a reference. Files are
+spread over a process pool with one model per worker. One JSON object per
+take is appended to --output as it finishes, with the WER columns when it
+has a reference. Takes already in --output for the same model are skipped,
+so an interrupted run can just be started again. A take that kills its
+worker process gets an error record; the other takes go on in a fresh pool.
+
+    python batch_transcribe.py records/ --model small --workers 4
+    python batch_transcribe.py data/ --output regrade.jsonl --compute-type int8
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+
+from app_loader import load_app
+from asr_common import corpus_wer, score_pairs
+
+AUDIO_SUFFIXES = {".wav", ".flac", ".ogg"}
+
+
+def find_takes(root):
+    """Yields (audio path, reference text or None) for every take under `root`."""
+    listed = set()
+    for meta_path in sorted(root.rglob("meta.json")):
+        with meta_path.open() as f:
+            for info in json.load(f):
+                path = meta_path.parent / info["file_name"]
+                listed.add(path)
+                if path.exists():
+                    yield path, info.get("text", info.get("script"))
+    for path in sorted(root.rglob("*")):
+        if path.suffix in AUDIO_SUFFIXES and path not in listed and not path.name.endswith(".tmp" + path.suffix):
+            yield path, None
+
+
+def finished_files(output, model_name):
+    """Takes already transcribed by `model_name` in `output`."""
+    if not output.exists():
+        return set()
+    done = set()
+    with output.open() as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut off by the interruption; that take runs again
+                continue
+            if "error" not in record and record.get("model") == model_name:
+                done.add(record["file"])
+    return done
+
+
+def ends_with_newline(path):
+    with path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+_model = None
+
+
+def init_worker(model_size, device, compute_type, cpu_threads):
+    global _model
+    from faster_whisper import WhisperModel
+    _model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+
+def transcribe_file(path, options):
+    from faster_whisper import decode_audio
+    start = time.perf_counter()
+    try:
+        audio = decode_audio(str(path))
+        segments, info = _model.transcribe(audio, **options)
+        transcript = "".join(segment.text for segment in segments)
+    except Exception as e:
+        return {"error": repr(e), "decode_seconds": time.perf_counter() - start}
+    return {
+        "transcript": transcript,
+        "language": info.language,
+        "audio_seconds": round(len(audio) / 16000, 3),
+        "decode_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def transcribe_takes(takes, workers, initargs, options):
+    """Yields (path, text, result of transcribe_file) for every take, as they finish.
+
+    At most `workers` takes are in flight, so when a worker process dies
+    (which breaks the whole pool) only those are suspects. They are retried
+    one by one in a single-worker pool: the one that breaks it again gets an
+    error result. The remaining takes go on in a fresh pool.
+    """
+    queue = deque(takes)
+    while queue:
+        suspects = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=init_worker, initargs=initargs) as pool:
+            running = {}
+            while (queue or running) and not suspects:
+                while queue and len(running) < workers:
+                    path, text = queue.popleft()
+                    running[pool.submit(transcribe_file, path, options)] = (path, text)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, text = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        suspects.append((path, text))
+                        continue
+                    except Exception as e:
+                        result = {"error": repr(e)}
+                    yield path, text, result
+            suspects.extend(running.values())
+
+        if len(suspects) == 1 and workers == 1:
+            path, text = suspects[0]
+            print(f"{path}: the worker process died")
+            yield path, text, {"error": "worker process died (crash or model load failure)"}
+        else:
+            for take in suspects:
+                yield from transcribe_takes([take], 1, initargs, options)
+
+
+def score_record(record, scores):
+    """Adds the WER columns to `record` (one with a reference)."""
+    score = score_pairs([record["reference"]], [record["transcript"]])[0]
+    scores.append(score)
+    record.update(wer=round(score.wer, 4), hits=score.hits, substitutions=score.substitutions,
+                  deletions=score.deletions, insertions=score.insertions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recordings", type=Path)
+    parser.add_argument("--output", type=Path, default=Path("batch_transcripts.jsonl"))
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--cpu-threads", type=int, default=0,
+                        help="per worker; 0: cores / workers, so workers do not oversubscribe the CPU")
+    parser.add_argument("--report-every", type=int, default=50)
+    args = parser.parse_args()
+
+    app = load_app()
+    cpu_threads = args.cpu_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    model_name = "/".join((args.model, args.device, args.compute_type))
+    done = finished_files(args.output, model_name)
+    takes = [(path, text) for path, text in find_takes(args.recordings)
+             if str(path.relative_to(args.recordings)) not in done]
+    print(f"{len(takes)} takes to transcribe ({len(done)} already in {args.output}), "
+          f"{args.workers} workers x {cpu_threads} threads")
+
+    start = time.perf_counter()
+    num_done = num_failed = 0
+    audio_seconds = 0.0
+    scores = []
+
+    initargs = (args.model, args.device, args.compute_type, cpu_threads)
+    with args.output.open("a") as out:
+        if out.tell() > 0 and not ends_with_newline(args.output):
+            out.write("\n")
+        for path, text, result in transcribe_takes(takes, args.workers, initargs, app.TRANSCRIBE_OPTIONS):
+            record = {"file": str(path.relative_to(args.recordings)), "reference": text, "model": model_name}
+            record.update(result)
+            if "error" in record:
+                num_failed += 1
+            else:
+                audio_seconds += record["audio_seconds"]
+                if text is not None:
+                    score_record(record, scores)
+            # written as soon as it is done, so an interrupted run loses no finished take
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            num_done += 1
+            if num_done % args.report_every == 0 or num_done == len(takes):
+                elapsed = time.perf_counter() - start
+                print(f"{num_done}/{len(takes)} takes, {num_done / elapsed:.2f} takes/s, "
+                      f"{audio_seconds / elapsed:.1f}x realtime, {num_failed} failed")
+
+    if scores:
+        print(f"WER {corpus_wer(scores):.2%} over {len(scores)} takes with a reference")
+    print(f"results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
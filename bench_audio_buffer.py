@@ -0,0 +1,91 @@
+"""Benchmark: pydub concatenation vs. AudioBuffer for WebRTC recording.
+
+Replays synthetic 20 ms WebRTC audio frames (48kHz, s16, stereo) through the
+old per-frame `pydub.AudioSegment` concatenation and through `AudioBuffer`.
+
+    python bench_audio_buffer.py
+    python bench_audio_buffer.py --durations 10 60 --frames-per-batch 3
+"""
+import argparse
+import time
+
+import av
+import numpy as np
+import pydub
+
+from asr_common import AudioBuffer
+
+
+def make_frame(sample_rate=48000, channels=2, frame_ms=20):
+    samples = sample_rate * frame_ms // 1000
+    data = np.random.randint(-3000, 3000, size=(1, samples * channels), dtype=np.int16)
+    layout = "stereo" if channels == 2 else "mono"
+    frame = av.AudioFrame.from_ndarray(data, format="s16", layout=layout)
+    frame.sample_rate = sample_rate
+    return frame
+
+
+def batches(frame, seconds, frames_per_batch, frame_ms=20):
+    num_frames = int(seconds * 1000 / frame_ms)
+    for i in range(0, num_frames, frames_per_batch):
+        yield [frame] * min(frames_per_batch, num_frames - i)
+
+
+def run_legacy(frame, seconds, frames_per_batch):
+    # Same code as the old WebRTCRecord.recording loop
+    audio_buffer = pydub.AudioSegment.empty()
+    for audio_frames in batches(frame, seconds, frames_per_batch):
+        sound_chunk = pydub.AudioSegment.empty()
+        for audio_frame in audio_frames:
+            sound = pydub.AudioSegment(
+                data=audio_frame.to_ndarray().tobytes(),
+                sample_width=audio_frame.format.bytes,
+                frame_rate=audio_frame.sample_rate,
+                channels=len(audio_frame.layout.channels),
+            )
+            sound_chunk += sound
+
+        if len(sound_chunk) > 0:
+            audio_buffer += sound_chunk
+    return audio_buffer
+
+
+def run_buffer(audio_buffer_class, frame, seconds, frames_per_batch):
+    audio_buffer = audio_buffer_class()
+    for audio_frames in batches(frame, seconds, frames_per_batch):
+        for audio_frame in audio_frames:
+            audio_buffer.append_frame(audio_frame)
+    # export-time conversion is part of the new path's cost
+    audio_buffer.to_audio_segment()
+    return audio_buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 60, 600])
+    parser.add_argument("--frames-per-batch", type=int, default=5)
+    parser.add_argument("--skip-legacy-over", type=float, default=None,
+                        help="skip the pydub path for takes longer than this (seconds)")
+    args = parser.parse_args()
+
+    frame = make_frame()
+
+    print(f"{'take':>8} {'pydub [s]':>10} {'AudioBuffer [s]':>16} {'speedup':>8}")
+    for seconds in args.durations:
+        start = time.perf_counter()
+        run_buffer(AudioBuffer, frame, seconds, args.frames_per_batch)
+        buffer_time = time.perf_counter() - start
+
+        if args.skip_legacy_over is not None and seconds > args.skip_legacy_over:
+            print(f"{seconds:>7.0f}s {'skipped':>10} {buffer_time:>16.3f} {'-':>8}")
+            continue
+
+        start = time.perf_counter()
+        run_legacy(frame, seconds, args.frames_per_batch)
+        legacy_time = time.perf_counter() - start
+
+        print(f"{seconds:>7.0f}s {legacy_time:>10.3f} {buffer_time:>16.3f} {legacy_time / buffer_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Offline benchmark for the record -> transcribe pipeline.
+
+Plays synthetic or fixture audio as 20 ms av.AudioFrame objects (48kHz
+stereo, like a browser sends) through the same FrameRecorder / to_whisper_audio /
+transcribe code as faster-whisper-english.py. No browser and no network are
+used: models must already be in the local Hugging Face cache.
+
+Each (model size, compute_type) runs in its own process so peak RSS is per
+configuration. One JSON object per run is appended to --output.
+
+    python bench_pipeline.py --models tiny base --compute-types int8
+    python bench_pipeline.py --fixture sample.wav --repeat 3
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import av
+import numpy as np
+from faster_whisper import WhisperModel
+
+from app_loader import load_app
+from asr_common import WHISPER_SAMPLE_RATE, FrameRecorder, to_whisper_audio, write_wav
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+FRAME_RATE = 48000
+FRAME_SAMPLES = 960  # 20 ms
+
+
+def synthetic_speech(seconds, sample_rate=FRAME_RATE, seed=0):
+    """Voiced 'syllables' (harmonics under an envelope) separated by short pauses."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = np.zeros_like(t)
+    pos = 0.3
+    while pos < seconds - 0.3:
+        length = rng.uniform(0.15, 0.35)
+        mask = (t >= pos) & (t < pos + length)
+        f0 = rng.uniform(100, 220)
+        envelope = np.sin(np.pi * (t[mask] - pos) / length)
+        signal[mask] = envelope * sum(np.sin(2 * np.pi * f0 * k * t[mask]) / k for k in range(1, 6))
+        pos += length + rng.uniform(0.05, 0.4)
+    signal += rng.normal(0, 0.01, len(signal))
+    pcm = (signal / max(np.abs(signal).max(), 1e-9) * 0.5 * 32767).astype(np.int16)
+    return np.stack([pcm, pcm], axis=1)
+
+
+def load_fixture(path):
+    """Decode any audio file to 48kHz stereo int16 (samples, 2)."""
+    resampler = av.AudioResampler(format="s16", layout="stereo", rate=FRAME_RATE)
+    chunks = []
+    with av.open(str(path)) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                chunks.append(out.to_ndarray().reshape(-1, 2))
+    for out in resampler.resample(None):
+        chunks.append(out.to_ndarray().reshape(-1, 2))
+    return np.concatenate(chunks)
+
+
+def to_frames(pcm):
+    frames = []
+    for i in range(0, len(pcm) - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        frame = av.AudioFrame.from_ndarray(
+            np.ascontiguousarray(pcm[i:i + FRAME_SAMPLES]).reshape(1, -1), format="s16", layout="stereo")
+        frame.sample_rate = FRAME_RATE
+        frames.append(frame)
+    return frames
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_config(model_size, compute_type, cpu_threads, pcm, repeat):
+    app = load_app()
+    frames = to_frames(pcm)
+    audio_seconds = len(frames) * FRAME_SAMPLES / FRAME_RATE
+    stages = {"ingest": [], "to_whisper_audio": [], "wav_export": [], "transcribe": []}
+    result = {
+        "model": model_size,
+        "compute_type": compute_type,
+        "cpu_threads": cpu_threads,
+        "audio_seconds": round(audio_seconds, 3),
+    }
+
+    start = time.perf_counter()
+    try:
+        model = WhisperModel(model_size, device="cpu", compute_type=compute_type,
+                                 cpu_threads=cpu_threads, local_files_only=True)
+    except Exception as e:
+        result["error"] = f"model not available offline: {e!r}"
+        return result
+    result["model_load_seconds"] = round(time.perf_counter() - start, 3)
+
+    transcript = ""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(repeat):
+            # same per-frame callback as the WebRTC worker thread calls
+            start = time.perf_counter()
+            recorder = FrameRecorder(target_rate=WHISPER_SAMPLE_RATE)
+            for audio_frame in frames:
+                recorder.on_frame(audio_frame)
+            audio_buffer, _ = recorder.take()
+            samples, sample_rate = audio_buffer.samples, audio_buffer.sample_rate
+            stages["ingest"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            audio = to_whisper_audio(samples, sample_rate)
+            stages["to_whisper_audio"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            write_wav(Path(tmp_dir) / "take.wav", samples, sample_rate)
+            stages["wav_export"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            transcript = app.transcribe(audio, model, show_log=False)
+            stages["transcribe"].append(time.perf_counter() - start)
+
+    result["stages"] = {name: round(statistics.median(times), 4) for name, times in stages.items()}
+    result["rtf"] = round(result["stages"]["transcribe"] / audio_seconds, 4)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["transcript"] = transcript
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8"])
+    parser.add_argument("--cpu-threads", type=int, default=0, help="0: ctranslate2 default")
+    parser.add_argument("--fixture", type=Path, help="audio file to use instead of synthetic audio")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the synthetic take")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=Path("bench_results.jsonl"))
+    args = parser.parse_args()
+
+    pcm = load_fixture(args.fixture) if args.fixture else synthetic_speech(args.seconds)
+    common = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "audio": str(args.fixture) if args.fixture else f"synthetic:{args.seconds}s",
+    }
+
+    with args.output.open("a") as out:
+        for model_size in args.models:
+            for compute_type in args.compute_types:
+                # fresh process per configuration so peak RSS is not shared
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(run_config, model_size, compute_type, args.cpu_threads,
+                                         pcm, args.repeat).result()
+                record = {**common, **result}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+                if "error" in record:
+                    print(f"{model_size}/{compute_type}: {record['error']}")
+                    continue
+                stages = " ".join(f"{k}={v:.3f}s" for k, v in record["stages"].items())
+                print(f"{model_size}/{compute_type}: load={record['model_load_seconds']:.2f}s {stages} "
+                      f"rtf={record['rtf']:.3f} peak_rss={record['peak_rss_mb']:.0f}MiB")
+
+    print(f"results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
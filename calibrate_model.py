@@ -0,0 +1,165 @@
+"""Pick the ASR model configuration for this host and save it for the app.
+
+Transcribes the reference clips with every combination of model size,
+compute_type, cpu_threads and num_workers (num_workers requests at once,
+like concurrent sessions). Each combination runs in a fresh process, so
+its peak RSS is its own. The configuration with the lowest WER over all
+clips whose per-request real-time factor and peak memory fit the budgets
+is written to asr_config.json, which faster-whisper-english.py reads at
+startup. On equal WER the larger model, then the higher precision wins.
+Models must already be in the local Hugging Face cache.
+
+    python calibrate_model.py --clip ref.wav --text "The cat sat on the mat." --max-rtf 0.5
+    python calibrate_model.py --clip a.wav --text "..." --clip b.wav --text "..." --models base small --workers 1 2
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from app_loader import load_app
+from asr_common import WHISPER_SAMPLE_RATE, corpus_wer, score_pairs
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def decode(model, audio, options):
+    start = time.perf_counter()
+    segments, _ = model.transcribe(audio, **options)
+    text = "".join(segment.text for segment in segments)
+    return time.perf_counter() - start, text
+
+
+def run_config(model_size, compute_type, cpu_threads, num_workers, clips, references, repeat):
+    """One configuration over every clip, meant for a fresh process (so peak RSS is this configuration's)."""
+    from faster_whisper import WhisperModel, decode_audio
+
+    app = load_app()
+    result = {"model_size": model_size, "compute_type": compute_type,
+              "cpu_threads": cpu_threads, "num_workers": num_workers}
+    try:
+        model = WhisperModel(model_size, device="cpu", compute_type=compute_type,
+                             cpu_threads=cpu_threads, num_workers=num_workers, local_files_only=True)
+    except Exception as e:
+        result["error"] = repr(e)
+        return result
+    app.warm_up_model(model)
+
+    rtfs = []
+    transcripts = []
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for clip in clips:
+            audio = decode_audio(str(clip))
+            audio_seconds = len(audio) / WHISPER_SAMPLE_RATE
+            transcript = ""
+            for _ in range(repeat):
+                futures = [pool.submit(decode, model, audio, app.TRANSCRIBE_OPTIONS) for _ in range(num_workers)]
+                for future in futures:
+                    latency, transcript = future.result()
+                    rtfs.append(latency / audio_seconds)
+            transcripts.append(transcript)
+    del model
+
+    result["rtf"] = round(statistics.median(rtfs), 4)
+    result["wer"] = round(corpus_wer(score_pairs(references, transcripts)), 4)
+    result["transcripts"] = transcripts
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return result
+
+
+# smallest / least precise first; unknown names rank lowest
+MODEL_SIZES = ["tiny", "base", "small", "medium", "large"]
+PRECISIONS = ["int8", "int8_float32", "int8_float16", "int8_bfloat16", "int16", "float16", "bfloat16", "float32"]
+
+
+def model_rank(model_size):
+    name = model_size.replace("distil-", "")
+    return max((rank for rank, size in enumerate(MODEL_SIZES) if name.startswith(size)), default=-1)
+
+
+def precision_rank(compute_type):
+    return PRECISIONS.index(compute_type) if compute_type in PRECISIONS else -1
+
+
+def choose(results, max_rtf, max_memory_mb):
+    """Lowest WER within the budgets. Ties go to the larger model, then the higher precision, then the faster one."""
+    fits = [r for r in results if "error" not in r and r["rtf"] <= max_rtf and r["peak_rss_mb"] <= max_memory_mb]
+    if not fits:
+        return None
+    return min(fits, key=lambda r: (r["wer"], -model_rank(r["model_size"]), -precision_rank(r["compute_type"]), r["rtf"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clip", type=Path, action="append", required=True,
+                        help="reference recording; repeat for more clips")
+    parser.add_argument("--text", action="append", required=True,
+                        help="what is said in the clip, once per --clip in the same order")
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small", "medium"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8", "float32"])
+    cpu_count = os.cpu_count() or 1
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({max(1, cpu_count // 2), cpu_count}))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--max-rtf", type=float, default=0.5, help="per-request decode time / audio length")
+    parser.add_argument("--max-memory-mb", type=float,
+                        default=int(os.environ.get("ASR_MODEL_MEMORY_MB", "2048")))
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--output", type=Path, default=Path(os.environ.get("ASR_CONFIG", "asr_config.json")))
+    args = parser.parse_args()
+    if len(args.clip) != len(args.text):
+        parser.error(f"{len(args.clip)} --clip but {len(args.text)} --text")
+
+    results = []
+    for model_size in args.models:
+        for compute_type in args.compute_types:
+            for cpu_threads in args.threads:
+                for num_workers in args.workers:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                        r = pool.submit(run_config, model_size, compute_type, cpu_threads, num_workers,
+                                        args.clip, args.text, args.repeat).result()
+                    name = f"{model_size}/{compute_type} threads={cpu_threads} workers={num_workers}"
+                    if "error" in r:
+                        print(f"{name}: {r['error']}")
+                    else:
+                        print(f"{name}: rtf={r['rtf']:.3f} wer={r['wer']:.2%} peak_rss={r['peak_rss_mb']:.0f}MiB")
+                    results.append(r)
+
+    best = choose(results, args.max_rtf, args.max_memory_mb)
+    if best is None:
+        print(f"no configuration meets rtf <= {args.max_rtf} and {args.max_memory_mb:.0f} MiB; {args.output} unchanged")
+        raise SystemExit(1)
+
+    config = {
+        "model_size": best["model_size"],
+        "compute_type": best["compute_type"],
+        "cpu_threads": best["cpu_threads"],
+        "num_workers": best["num_workers"],
+        "calibration": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "cpu_count": cpu_count,
+            "clips": [str(clip) for clip in args.clip],
+            "max_rtf": args.max_rtf,
+            "max_memory_mb": args.max_memory_mb,
+            "rtf": best["rtf"],
+            "wer": best["wer"],
+            "peak_rss_mb": best["peak_rss_mb"],
+        },
+    }
+    args.output.write_text(json.dumps(config, ensure_ascii=False, indent=4) + "\n")
+    print(f"chose {best['model_size']}/{best['compute_type']} threads={best['cpu_threads']} "
+          f"workers={best['num_workers']} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
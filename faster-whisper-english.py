@@ -1,6 +1,7 @@
 import hashlib
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
 @dataclass
 class Question:
@@ -8,6 +9,9 @@ class Question:
     script: str
     transcript: str
     wav_dir_path: Path
+    job: Any = None  # TranscriptionJob of the background transcription
+    alignment: Any = None  # list of WordAlignment in the alignment scoring mode
+    tier: str = ""  # where the transcript came from: draft / final / align (see TIER_LABELS)
 
     @property
     def file_id(self):
@@ -26,25 +30,168 @@ class Question:
         return {"script": self.script, "file_name": self.output_wav_name}
 
 
-import queue
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+from asr_common import NULL_METRICS, Metrics
+
+class JsonlMetricsSink:
+    """Appends every span / counter event as one JSON line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+class PrometheusMetricsSink:
+    """Aggregates events in memory and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}  # (name, labels) -> [count, sum]
+        self._counters = {}  # (name, labels) -> value
+
+    def emit(self, record):
+        labels = tuple(sorted((k, str(v)) for k, v in record.items() if k not in ("type", "name", "seconds", "value", "ts")))
+        key = (record["name"], labels)
+        with self._lock:
+            if record["type"] == "span":
+                entry = self._spans.setdefault(key, [0, 0.0])
+                entry[0] += 1
+                entry[1] += record["seconds"]
+            else:
+                self._counters[key] = self._counters.get(key, 0) + record["value"]
+
+    @staticmethod
+    def _escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _labels(cls, name, labels):
+        return ",".join([f'name="{cls._escape(name)}"'] + [f'{k}="{cls._escape(v)}"' for k, v in labels])
+
+    def render(self):
+        lines = ["# TYPE asr_span_seconds summary"]
+        with self._lock:
+            for (name, labels), (count, total) in sorted(self._spans.items()):
+                lines.append(f"asr_span_seconds_count{{{self._labels(name, labels)}}} {count}")
+                lines.append(f"asr_span_seconds_sum{{{self._labels(name, labels)}}} {total:.6f}")
+            lines.append("# TYPE asr_events_total counter")
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"asr_events_total{{{self._labels(name, labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics: serving http://{host}:{port}/metrics")
+
+@st.cache_resource
+def get_metrics():
+    # ASR_METRICS_JSONL=path : 全イベントを JSONL に追記
+    # ASR_METRICS_PORT=9100  : Prometheus 形式で /metrics を公開
+    # ASR_METRICS_HOST=addr  : /metrics を待ち受けるアドレス (既定は 127.0.0.1。外から取るなら 0.0.0.0)
+    sinks = []
+    if os.environ.get("ASR_METRICS_JSONL"):
+        sinks.append(JsonlMetricsSink(os.environ["ASR_METRICS_JSONL"]))
+    if os.environ.get("ASR_METRICS_PORT"):
+        prometheus = PrometheusMetricsSink()
+        prometheus.serve(int(os.environ["ASR_METRICS_PORT"]), os.environ.get("ASR_METRICS_HOST", "127.0.0.1"))
+        sinks.append(prometheus)
+    return Metrics(sinks)
+
 
-import pydub
 import streamlit as st
-from streamlit_webrtc import WebRtcMode, webrtc_streamer
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asr_common import (
+    BUFFER_RAM_BYTES, MAX_TAKE_SECONDS, STORAGE_FORMATS, WHISPER_SAMPLE_RATE, FrameRecorder, ThrottledUpdater,
+    find_speech_bounds, get_recording_memory, recording_memory_sidebar, stored_audio_path, to_whisper_audio,
+    write_audio, write_wav,
+)
+
+# 録音を WAV としても保存するか (文字起こし自体はメモリ上の音声で行う)
+SAVE_RECORDINGS = os.environ.get("ASR_SAVE_RECORDINGS", "1") == "1"
+# 保存形式 (STORAGE_FORMATS のキー)。エンコードも書き込みスレッドで行う
+STORAGE_CODEC = os.environ.get("ASR_STORAGE_CODEC", "wav")
+
+@st.cache_resource
+def get_audio_writer():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="wav-writer")
+
+def save_take(file_path, samples, sample_rate, metrics, codec=STORAGE_CODEC):
+    """Store the take in the `codec` storage format; returns the path written."""
+    encoder, suffix, _ = STORAGE_FORMATS[codec]
+    file_path = file_path.with_suffix(suffix)
+    if encoder is None:
+        with metrics.span("wav_export"):
+            write_wav(file_path, samples, sample_rate)
+    else:
+        with metrics.span("audio_encode", codec=codec):
+            write_audio(file_path, samples, sample_rate, encoder)
+    metrics.count("stored_bytes", file_path.stat().st_size, codec=codec)
+    metrics.count("pcm_bytes", samples.nbytes, codec=codec)
+    return file_path
+
+
+def level_meter(level_db, floor_db=-60.0):
+    """st.progress arguments for a level in dBFS, in 5% / 3dB steps so small changes are not re-sent."""
+    fraction = min(max((level_db - floor_db) / -floor_db, 0.0), 1.0)
+    shown_db = max(round(level_db / 3) * 3, floor_db)
+    return int(fraction * 20) * 5, f"Level {shown_db:.0f} dBFS"
+
+
 
 class WebRTCRecord:
     def __init__(self):
+        # aiortc ごと読み込むので重い。録音画面を出すときに初めて import する
+        from streamlit_webrtc import WebRtcMode, create_audio_sink_track, webrtc_streamer
+
         st_webrtc_logger = logging.getLogger("streamlit_webrtc")
         #st_webrtc_logger.setLevel(logging.WARNING)
         #st_webrtc_logger.setLevel(logging.DEBUG)
         #print("set webtrc_logger to DEBUG.")
+        if "frame_recorder" not in st.session_state:
+            st.session_state["frame_recorder"] = FrameRecorder(
+                target_rate=WHISPER_SAMPLE_RATE, metrics=get_metrics(), ram_budget=BUFFER_RAM_BYTES,
+                max_seconds=MAX_TAKE_SECONDS, tracker=get_recording_memory())
+        self.recorder = st.session_state["frame_recorder"]
+
+        # フレームはコールバックで WebRTC のイベントループから recorder に渡される
         self.webrtc_ctx = webrtc_streamer(
             key="sendonly-audio",
             mode=WebRtcMode.SENDONLY,
-            #audio_receiver_size=256,
-            audio_receiver_size=512,
+            sink_audio_track=create_audio_sink_track(
+                self.recorder.on_frame, key="sendonly-audio-sink", on_ended=self.recorder.on_ended),
             rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
             media_stream_constraints={
                 "audio": True,
@@ -60,68 +207,135 @@ class WebRTCRecord:
         #    }
         #)
 
-        if "audio_buffer" not in st.session_state:
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
-
-    def recording(self, question):
+    def recording(self, question, streaming=False, scoring_mode="transcribe", two_pass=False):
         #print("recording IN.")
         status_box = st.empty()
+        level_box = st.empty()
+        partial_box = st.empty()
+        metrics = get_metrics()
+        recorder = self.recorder
+        # 変わった値だけを、ASR_UI_MAX_FPS を超えない頻度でブラウザに送る
+        status = ThrottledUpdater(status_box)
+        level = ThrottledUpdater(level_box)
+        partial = ThrottledUpdater(partial_box)
+        recorder.set_playing(self.webrtc_ctx.state.playing)
 
-        while True:
-            #print("recording start...")
-            if self.webrtc_ctx.audio_receiver:
-                try:
-                    #print("Try get_frames...")
-                    #status_box.info("Try get_frames...")
-                    audio_frames = self.webrtc_ctx.audio_receiver.get_frames(timeout=1)
-                except queue.Empty:
-                    status_box.warning("No frame arrived.")
-                    print("No frame arrived.")
-                    continue
-
-                status_box.info("Now Recording...")
-                #print("Now Recording...")
-
-                sound_chunk = pydub.AudioSegment.empty()
-                for audio_frame in audio_frames:
-                    sound = pydub.AudioSegment(
-                        data=audio_frame.to_ndarray().tobytes(),
-                        sample_width=audio_frame.format.bytes,
-                        frame_rate=audio_frame.sample_rate,
-                        channels=len(audio_frame.layout.channels),
-                    )
-                    sound_chunk += sound
-
-                if len(sound_chunk) > 0:
-                    st.session_state["audio_buffer"] += sound_chunk
-            else:
-                break
+        if streaming and self.webrtc_ctx.state.playing and recorder.streaming_transcriber is None:
+            recorder.streaming_transcriber = StreamingTranscriber(
+                asr_model(), get_transcription_scheduler(), metrics)
 
-        audio_buffer = st.session_state["audio_buffer"]
+        # ここでは状態を表示するだけ (フレームの受け取りはワーカースレッド側)
+        last_frames = -1
+        last_frame_at = time.monotonic()
+        while self.webrtc_ctx.state.playing and not recorder.track_ended:
+            if recorder.frames != last_frames:
+                last_frames = recorder.frames
+                last_frame_at = time.monotonic()
+                if recorder.buffer.truncated:
+                    status.update("warning", f"最大録音時間 ({MAX_TAKE_SECONDS:.0f}秒) に達しました。録音を止めてください。")
+                else:
+                    status.update("info", f"Now Recording... ({recorder.duration:.0f}s)")
+                level.update("progress", *level_meter(recorder.level_db()))
+                streaming_transcriber = recorder.streaming_transcriber
+                if streaming_transcriber is not None:
+                    partial.update("caption", streaming_transcriber.partial_text())
+            elif time.monotonic() - last_frame_at > 1:
+                metrics.count("frame_gaps")
+                status.update("warning", "No frame arrived.")
+                print("No frame arrived.")
+                last_frame_at = time.monotonic()
+            time.sleep(status.min_interval or 0.2)
+        for name, updater in (("status", status), ("level", level), ("partial", partial)):
+            updater.flush()
+            if updater.requested:
+                updater.report(metrics, element=name)
 
-        if not self.webrtc_ctx.state.playing and len(audio_buffer) > 0:
+        if not self.webrtc_ctx.state.playing and len(recorder) > 0:
+            level_box.empty()
             status_box.success("Finish Recording")
-            try:
-                audio_buffer.export(str(question.wav_file_path), format="wav")
-            except BaseException:
-                st.error("Error while Writing wav to disk")
+            audio_buffer, streaming_transcriber = recorder.take()
+            samples, sample_rate = audio_buffer.samples, audio_buffer.sample_rate
+            # 前後の無音を落としてから保存・文字起こしする
+            start, end = find_speech_bounds(samples, sample_rate)
+            lead, tail = start / sample_rate, (len(samples) - end) / sample_rate
+            samples = samples[start:end]
+            metrics.observe("silence_trimmed", lead, edge="lead")
+            metrics.observe("silence_trimmed", tail, edge="tail")
+            st.caption(f"無音カット：先頭 {lead:.2f}s / 末尾 {tail:.2f}s")
+            print(f"Recorded {len(samples) / sample_rate:.2f}s at {sample_rate}Hz/{samples.shape[1]}ch ({samples.nbytes} Byte)")
 
-            # Reset
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
+            # ディスクへの保存は文字起こしと並行して裏で行う
+            wav_future = None
+            if SAVE_RECORDINGS:
+                wav_future = get_audio_writer().submit(save_take, question.wav_file_path, samples, sample_rate, metrics)
+
+            # WAV を経由せずにメモリ上の音声をそのまま渡す (どの経路でも同じ配列を使う)
+            audio = to_whisper_audio(samples, sample_rate)
+            cache = st.session_state["TRANSCRIPT_CACHE"]
+            alignment = None
+            refine_job = None
+            tier = "final"
+            if scoring_mode == "align":
+                # 原稿が分かっているので、自由な探索ではなく原稿に合わせて整列させる
+                alignment = align_script(audio, asr_model(), question.script, metrics)
+                if alignment is None:
+                    st.warning(f"{ALIGN_MAX_SECONDS}秒を超える録音は通常の文字起こしで採点します")
+
+            if alignment is not None:
+                transcript = aligned_transcript(alignment)
+                tier = "align"
+                show_alignment(alignment)
+            elif streaming_transcriber is not None:
+                # 録音中に区切りごとに変換済み。残りの区切りだけ待つ
+                start = time.perf_counter()
+                transcript = streaming_transcriber.finish()
+                print(f"経過時間(stop→結果)： {time.perf_counter() - start}")
+                if transcript is None:
+                    # 送りきれなかった・失敗した区切りがあるときは、録音全体を 1 度だけ文字起こしする
+                    if streaming_transcriber.errors:
+                        st.warning(f"区切りの文字起こしに失敗しました ({streaming_transcriber.errors[0]})。録音全体で文字起こしします。")
+                    else:
+                        st.warning("サーバーが混雑しているため、録音全体で文字起こしします。")
+                    transcript = cached_transcribe(audio, asr_model(), st.session_state["ASR_MODEL_KEY"], cache, metrics)
+            elif two_pass:
+                # 速報は小さいモデルですぐに出し、確定版は大きいモデルで裏で作り直す
+                draft_key = st.session_state["ASR_DRAFT_MODEL_KEY"]
+                transcript = cached_transcribe(audio, asr_model(draft_key), draft_key, cache, metrics)
+                tier = "draft"
+                try:
+                    refine_job = get_transcription_scheduler().submit(
+                        refine_transcript, audio, get_model_registry(), st.session_state["ASR_MODEL_KEY"], cache, metrics)
+                except SchedulerBusy:
+                    st.warning("サーバーが混雑しているため、速報のみです。")
+            else:
+                transcript = cached_transcribe(audio, asr_model(), st.session_state["ASR_MODEL_KEY"], cache, metrics)
 
-            # ここで変換してみる
-            model = st.session_state["ASR_MODEL"]
-            transcript = transcribe(question.wav_file_path, model)
-            file_size = os.path.getsize(question.wav_file_path)
-            st.write(f"File：{question.wav_file_path} ({file_size} Byte)")
-            st.write(f"聞き取り：{transcript}")
+            if wav_future is not None:
+                if wav_future.exception() is not None:
+                    st.error("Error while Writing wav to disk")
+                else:
+                    file_path = wav_future.result()
+                    file_size = os.path.getsize(file_path)
+                    st.write(f"File：{file_path} ({file_size} Byte, PCM の {file_size / max(samples.nbytes, 1):.0%})")
+            heard_box = st.empty()
+            heard_box.write(f"聞き取り [{TIER_LABELS[tier]}]：{transcript}")
+            answered = st.session_state["questions"][question.script_index]
+            if answered.job is not None and not answered.job.finished:
+                answered.job.cancel()
+            answered.transcript = transcript
+            answered.alignment = alignment
+            answered.tier = tier
+            answered.job = refine_job
+            if refine_job is not None:
+                # 確定版が出たら、この行だけを書き換える
+                st.fragment(watch_refinement, run_every=1.0)(heard_box, answered)
 
         #print("recording OUT.")
 
 
-import threading
+import os
+import time
 #import whisper
-from faster_whisper import WhisperModel
 import streamlit as st
 
 def format_string(s):
@@ -130,10 +344,26 @@ def format_string(s):
     s = s.strip()
     return s
 
-def transcribe(file_path, model):
+def transcribe(audio, model, metrics=NULL_METRICS, show_log=True):
+    """`audio` is a file path or a 16kHz mono float32 array (see to_whisper_audio).
+
+    With `show_log`, the progress is drawn on the page. Pass False off the
+    script thread: Streamlit elements created there are silently dropped.
+    """
+    if isinstance(audio, np.ndarray):
+        source = f"<in-memory {len(audio) / WHISPER_SAMPLE_RATE:.2f}s>"
+    else:
+        source = audio = str(audio)
     #result = model.transcribe(str(file_path), verbose=True)
-    print(f"{file_path} transcribe...")
-    st.write(f"{file_path} transcribe...")
+    # 区切りごとに st.write せず、1 つの枠をまとめて更新する
+    log = ThrottledUpdater(st.empty()) if show_log else None
+    log_lines = []
+    def log_line(line):
+        print(line)
+        if log is not None:
+            log_lines.append(line)
+            log.update("markdown", "  \n".join(log_lines))
+    log_line(f"{source} transcribe...")
 
     # https://github.com/SYSTRAN/faster-whisper/blob/master/faster_whisper/vad.py#L14
     # vad_parameters=dict(min_silence_duration_ms=500)
@@ -151,34 +381,678 @@ def transcribe(file_path, model):
     # vad_parameters=vad_parameters,
     # without_timestamps=True,)
 
+    # 言語判定はこの呼び出しの中で行われる (segments の生成は遅延評価)
+    start = time.perf_counter()
     segments, info = model.transcribe(
-    	str(file_path),
-    	beam_size=5,)
-    print(f"lang:({info.language}) prob:({info.language_probability}) duration:({info.duration})")
-    st.write(f"lang:({info.language}) prob:({info.language_probability}) duration:({info.duration})")
+    	audio,
+    	**TRANSCRIBE_OPTIONS,)
+    metrics.observe("language_detection", time.perf_counter() - start)
+    log_line(f"lang:({info.language}) prob:({info.language_probability}) duration:({info.duration})")
 
     text = ""
+    start = time.perf_counter()
     for segment in segments:
-        print("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
-        st.write(f"[{segment.start:.2f}s -> {segment.end:.2f}s] {segment.text}")
+        metrics.observe("segment_decode", time.perf_counter() - start)
+        log_line(f"[{segment.start:.2f}s -> {segment.end:.2f}s] {segment.text}")
         text += segment.text
+        start = time.perf_counter()
+    if log is not None:
+        log.flush()
 
     #return format_string(result["text"])
     return text
 
-import time
-def async_transcribe(question, model):
+def async_transcribe(file_path, model, model_key, cache, metrics):
     start = time.perf_counter()
-    transcript = transcribe(question.wav_file_path, model)
+    # ワーカースレッドなので画面には描かない
+    transcript = cached_transcribe(file_path, model, model_key, cache, metrics, show_log=False)
     end = time.perf_counter()
     print(f"経過時間： {end - start}")
-    question.transcript = transcript
     print(f" #### transcript: {transcript}")
+    return transcript
+
+# 結果の出どころ。draft は ASR_DRAFT_MODEL の速報で、確定版 (final) が出たら置き換わる
+TIER_LABELS = {"draft": "速報", "final": "確定", "align": "整列"}
+ASR_DRAFT_MODEL = os.environ.get("ASR_DRAFT_MODEL", "tiny")
+
+def refine_transcript(audio, registry, model_key, cache, metrics):
+    """Second pass on the scheduler: the configured model re-decodes the array the draft used."""
+    # 読み込み中ならここ (ワーカースレッド) で待つので、速報の表示は止めない
+    return cached_transcribe(audio, registry.get(*model_key), model_key, cache, metrics, show_log=False)
+
+def apply_refinement(question):
+    """Replace a draft transcript with the finished refinement. Returns True when it did."""
+    job = question.job
+    if job is None or job.status != "done" or (question.transcript and question.tier != "draft"):
+        return False
+    question.transcript = job.result
+    question.tier = "final"
+    return True
+
+def watch_refinement(heard_box, question):
+    """Run by run_every after a two-pass take. Draws nothing on its own: once the
+    refinement is done, it rewrites the transcript line in heard_box (outside this fragment)."""
+    if apply_refinement(question):
+        heard_box.write(f"聞き取り [{TIER_LABELS[question.tier]}]：{question.transcript}")
+
+def start_transcription_job(question):
+    """Queue `question` on the shared scheduler. Returns False when it is busy."""
+    if question.job is not None and not question.job.finished:
+        question.job.cancel()
+    model = asr_model()
+    try:
+        question.job = get_transcription_scheduler().submit(
+            async_transcribe, stored_audio_path(question.wav_file_path), model,
+            st.session_state["ASR_MODEL_KEY"], st.session_state["TRANSCRIPT_CACHE"], get_metrics())
+    except SchedulerBusy as e:
+        print(f"start_transcription_job: busy ({e})")
+        return False
+    return True
+
+
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+class TranscriptCache:
+    """Transcripts keyed by a hash of the audio samples, the model and the decode options.
+
+    An in-memory LRU tier sits in front of an optional on-disk tier
+    (one small JSON file per key under `cache_dir`).
+    """
+
+    def __init__(self, max_entries=512, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(audio, model_key, options):
+        h = hashlib.sha256()
+        h.update(json.dumps([list(model_key), options], sort_keys=True).encode())
+        h.update(np.ascontiguousarray(audio, dtype=np.float32))
+        return h.hexdigest()
+
+    def _remember(self, key, text):
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counts["memory_hits"] += 1
+                return self._entries[key]
+
+        if self.cache_dir:
+            try:
+                with (self.cache_dir / f"{key}.json").open() as f:
+                    text = json.load(f)["text"]
+            except (OSError, ValueError, KeyError):
+                pass
+            else:
+                with self._lock:
+                    self._remember(key, text)
+                    self.counts["disk_hits"] += 1
+                return text
+
+        with self._lock:
+            self.counts["misses"] += 1
+        return None
+
+    def put(self, key, text, **info):
+        with self._lock:
+            self._remember(key, text)
+        if self.cache_dir:
+            path = self.cache_dir / f"{key}.json"
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            try:
+                with tmp_path.open("w") as f:
+                    json.dump({"text": text, **info}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # ディスクが一杯などで書けなくても、メモリ上のエントリはそのまま使う
+                print(f"TranscriptCache: could not write {path}: {e!r}")
+                tmp_path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "entries": len(self._entries)}
+
+# 16kHz mono float32 の音声に対して変換する時のパラメータ
+TRANSCRIBE_OPTIONS = {"beam_size": 5}
+TRANSCRIPT_DISK_CACHE = os.environ.get("ASR_TRANSCRIPT_DISK_CACHE", "1") == "1"
+
+@st.cache_resource
+def get_transcript_cache(cache_dir=None):
+    return TranscriptCache(cache_dir=cache_dir)
+
+def cached_transcribe(audio, model, model_key, cache, metrics=NULL_METRICS, show_log=True):
+    """transcribe() with a lookup in `cache` first. `audio` may be a path or a 16kHz float32 array."""
+    if not isinstance(audio, np.ndarray):
+        # decode once here so the key depends on the samples, not on the container
+        from faster_whisper import decode_audio
+        audio = decode_audio(str(audio), sampling_rate=WHISPER_SAMPLE_RATE)
+    key = cache.make_key(audio, model_key, TRANSCRIBE_OPTIONS)
+    text = cache.get(key)
+    if text is not None:
+        metrics.count("transcript_cache_hits")
+        print(f"cached_transcribe: hit {key[:12]}")
+        return text
+    metrics.count("transcript_cache_misses")
+    with metrics.span("transcribe", model="/".join(model_key)):
+        text = transcribe(audio, model, metrics, show_log=show_log)
+    cache.put(key, text, model="/".join(model_key), options=TRANSCRIBE_OPTIONS)
+    return text
+
+def transcript_cache_sidebar(cache):
+    stats = cache.stats()
+    st.sidebar.subheader("Transcript cache")
+    st.sidebar.caption(
+        f"memory hits {stats['memory_hits']} / disk hits {stats['disk_hits']} / "
+        f"misses {stats['misses']} ({stats['entries']} in memory)"
+    )
+
+
+
+import streamlit as st
+
+from asr_common import SchedulerBusy, get_transcription_scheduler, transcription_queue_sidebar
+
+
+
+import math
+import os
+import time
+from collections import deque
+
+class SpeechSegmenter:
+    """Energy-based voice activity segmenter over incoming PCM frames.
+
+    A chunk starts when a frame is louder than the (adaptive) noise floor and
+    ends after `min_silence_ms` of quiet, or when it reaches `max_chunk_s`.
+    Finished chunks are returned from `push()` / `flush()` as (samples, channels)
+    arrays at the input sample rate.
+    """
+
+    def __init__(self, threshold_db=-45.0, margin_db=12.0, min_silence_ms=600,
+                 min_speech_ms=250, pad_ms=200, max_chunk_s=20.0):
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.min_silence_ms = min_silence_ms
+        self.min_speech_ms = min_speech_ms
+        self.pad_ms = pad_ms
+        self.max_chunk_s = max_chunk_s
+        self.noise_floor_db = -70.0
+        self._pre_roll = deque()
+        self._pre_roll_ms = 0.0
+        self._chunk = []
+        self._speech_ms = 0.0
+        self._chunk_ms = 0.0
+        self._silence_ms = 0.0
+
+    @staticmethod
+    def frame_db(array):
+        scale = float(np.iinfo(array.dtype).max + 1)
+        power = np.mean(np.square(array, dtype=np.float32)) / (scale * scale)
+        return 10 * math.log10(max(power, 1e-12))
+
+    def push(self, array, sample_rate):
+        frame_ms = 1000 * len(array) / sample_rate
+        db = self.frame_db(array)
+        is_speech = db > max(self.threshold_db, self.noise_floor_db + self.margin_db)
 
-def start_transcription_thread(question):
-    model = st.session_state["ASR_MODEL"]
-    x = threading.Thread(target=async_transcribe, args=(question, model))
-    x.start()
+        if not self._chunk:
+            if not is_speech:
+                # slowly track the background level while nobody is talking
+                self.noise_floor_db += 0.05 * (db - self.noise_floor_db)
+                self._pre_roll.append(array)
+                self._pre_roll_ms += frame_ms
+                while self._pre_roll and self._pre_roll_ms - 1000 * len(self._pre_roll[0]) / sample_rate >= self.pad_ms:
+                    self._pre_roll_ms -= 1000 * len(self._pre_roll.popleft()) / sample_rate
+                return None
+            self._chunk = list(self._pre_roll)
+            self._chunk_ms = self._pre_roll_ms
+            self._pre_roll.clear()
+            self._pre_roll_ms = 0.0
+            self._speech_ms = 0.0
+            self._silence_ms = 0.0
+
+        self._chunk.append(array)
+        self._chunk_ms += frame_ms
+        if is_speech:
+            self._speech_ms += frame_ms
+            self._silence_ms = 0.0
+        else:
+            self._silence_ms += frame_ms
+
+        if self._silence_ms >= self.min_silence_ms or self._chunk_ms >= 1000 * self.max_chunk_s:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk, speech_ms = self._chunk, self._speech_ms
+        self._chunk = []
+        self._chunk_ms = 0.0
+        self._speech_ms = 0.0
+        self._silence_ms = 0.0
+        if not chunk or speech_ms < self.min_speech_ms:
+            return None
+        return np.concatenate(chunk)
+
+# 停止後、残りの区切りをキューに入れられるまで待つ上限 (秒)。超えたら録音全体を 1 度で文字起こしする
+STREAMING_FINISH_TIMEOUT = float(os.environ.get("ASR_STREAMING_FINISH_TIMEOUT", "10"))
+
+def transcribe_chunk(audio, model, metrics=NULL_METRICS):
+    with metrics.span("chunk_transcribe"):
+        segments, info = model.transcribe(audio, beam_size=5, language="en")
+        text = "".join(segment.text for segment in segments)
+    print(f"[chunk {info.duration:.2f}s] {text}")
+    return text
+
+class StreamingTranscriber:
+    """Transcribes speech chunks on the shared scheduler while recording goes on."""
+
+    def __init__(self, model, scheduler, metrics=NULL_METRICS):
+        self.model = model
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.segmenter = SpeechSegmenter()
+        self.sample_rate = None
+        self._pending = deque()  # chunks waiting for a free queue slot
+        self._jobs = []
+        self.errors = []  # errors of failed chunks, set by finish()
+
+    def feed(self, array, sample_rate):
+        self.sample_rate = sample_rate
+        chunk = self.segmenter.push(array, sample_rate)
+        if chunk is not None:
+            self._pending.append(to_whisper_audio(chunk, self.sample_rate))
+        if self._pending:
+            self._submit_pending()
+
+    def _submit_pending(self):
+        while self._pending:
+            try:
+                job = self.scheduler.submit(transcribe_chunk, self._pending[0], self.model, self.metrics)
+            except SchedulerBusy:
+                # retried with the next frame, keeping the chunk order
+                return False
+            self._pending.popleft()
+            self._jobs.append(job)
+        return True
+
+    @property
+    def num_chunks(self):
+        return len(self._jobs) + len(self._pending)
+
+    def partial_text(self):
+        texts = []
+        for job in self._jobs:
+            if not job.finished:
+                break
+            if job.status == "done":
+                texts.append(job.result)
+        return "".join(texts).strip()
+
+    def finish(self, timeout=STREAMING_FINISH_TIMEOUT):
+        """Text of all chunks, or None when it is incomplete.
+
+        None means the remaining chunks could not be queued within `timeout`
+        seconds, or a chunk failed (see `errors`). The caller should then
+        transcribe the whole take once instead.
+        """
+        chunk = self.segmenter.flush()
+        if chunk is not None:
+            self._pending.append(to_whisper_audio(chunk, self.sample_rate))
+        deadline = time.monotonic() + timeout
+        while not self._submit_pending():
+            if time.monotonic() > deadline:
+                print(f"StreamingTranscriber: {len(self._pending)} chunks not queued after {timeout}s")
+                self.metrics.count("streaming_fallback", reason="busy")
+                self.cancel()
+                return None
+            time.sleep(0.1)
+        for job in self._jobs:
+            job.wait()
+        self.errors = [job.error or job.status for job in self._jobs if job.status != "done"]
+        if self.errors:
+            print(f"StreamingTranscriber: {len(self.errors)} chunks failed: {self.errors}")
+            self.metrics.count("streaming_fallback", reason="failed")
+            return None
+        return "".join(job.result for job in self._jobs)
+
+    def cancel(self):
+        self._pending.clear()
+        for job in self._jobs:
+            job.cancel()
+
+
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import streamlit as st
+
+# 単語の確率がこれ以上なら「読めた」とみなす
+ALIGN_MIN_PROBABILITY = float(os.environ.get("ASR_ALIGN_MIN_PROBABILITY", "0.3"))
+# Whisper のエンコーダが一度に見られる長さ
+ALIGN_MAX_SECONDS = 30
+
+@dataclass
+class WordAlignment:
+    word: str
+    start: float
+    end: float
+    probability: float
+
+    @property
+    def matched(self):
+        return self.probability >= ALIGN_MIN_PROBABILITY
+
+def align_script(audio, model, script, metrics=NULL_METRICS):
+    """Force-align the known `script` to `audio` (16kHz mono float32).
+
+    Instead of a free beam search, the script tokens are fed to the decoder
+    (teacher forcing) in a single pass; the cross-attention gives word timing
+    and the token probabilities give a per-word confidence.
+    Returns None when the take is too long for one encoder window.
+    """
+    if len(audio) > ALIGN_MAX_SECONDS * WHISPER_SAMPLE_RATE:
+        return None
+    if isinstance(model, RemoteWhisperModel):
+        with metrics.span("forced_alignment"):
+            return model.align_script(audio, script)
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language="en")
+    text_tokens = tokenizer.encode(" " + script.strip())
+
+    with metrics.span("forced_alignment"):
+        features = model.feature_extractor(audio)
+        num_frames = min(features.shape[-1] - 1, model.feature_extractor.nb_max_frames)
+        encoder_output = model.encode(pad_or_trim(features[:, :num_frames]))
+        words = model.find_alignment(tokenizer, [text_tokens], encoder_output, num_frames)[0]
+
+    return [
+        WordAlignment(word["word"].strip(), float(word["start"]), float(word["end"]), float(word["probability"]))
+        for word in words
+    ]
+
+def aligned_transcript(alignment):
+    """Words the speaker got right, in script order; missed words are left out."""
+    return " ".join(word.word for word in alignment if word.matched)
+
+def show_alignment(alignment):
+    st.dataframe(
+        [
+            {
+                "word": word.word,
+                "start [s]": round(word.start, 2),
+                "end [s]": round(word.end, 2),
+                "confidence": round(word.probability, 3),
+                "OK": word.matched,
+            }
+            for word in alignment
+        ],
+        hide_index=True,
+    )
+
+
+
+from asr_common import corpus_wer, score_questions
+
+
+
+import os
+import secrets
+import tempfile
+from multiprocessing import AuthenticationError, shared_memory
+from multiprocessing.connection import Client
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# 設定すると inference_server.py (別プロセス) でモデルを動かす
+ASR_INFERENCE_SOCKET = os.environ.get("ASR_INFERENCE_SOCKET")
+
+def inference_runtime_dir():
+    """Directory for the inference server's socket and key, only accessible to this user."""
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    path = Path(base) / f"asr-inference-{os.getuid()}"
+    path.mkdir(mode=0o700, exist_ok=True)
+    stat = path.stat()
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise RuntimeError(f"{path} must belong to this user and be closed to others (mode 0700)")
+    return path
+
+def inference_authkey(create=False):
+    """Key shared by inference_server.py and its clients.
+
+    ASR_INFERENCE_AUTHKEY if set, otherwise the contents of
+    ASR_INFERENCE_AUTHKEY_FILE (default: `authkey` in inference_runtime_dir()).
+    With `create`, a missing file gets a random key, readable by this user only.
+    """
+    if os.environ.get("ASR_INFERENCE_AUTHKEY"):
+        return os.environ["ASR_INFERENCE_AUTHKEY"].encode()
+    path = Path(os.environ.get("ASR_INFERENCE_AUTHKEY_FILE") or inference_runtime_dir() / "authkey")
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    try:
+        return path.read_text().strip().encode()
+    except FileNotFoundError:
+        raise RuntimeError(
+            f"no inference server key in {path}: start inference_server.py or set ASR_INFERENCE_AUTHKEY") from None
+
+class RemoteWhisperModel:
+    """Stand-in for WhisperModel whose transcribe() runs in inference_server.py.
+
+    The audio goes over in a shared-memory block, only the request and the
+    segments go through the Unix socket. Creating one asks the server to
+    load the model, so a missing server fails at startup, not mid-take.
+    """
+
+    def __init__(self, address, model_key, authkey=None):
+        self.address = address
+        self.model_key = tuple(model_key)
+        self.authkey = authkey or inference_authkey()
+        self.server_pid = self._call({"op": "load"})["pid"]
+
+    def _call(self, request, audio=None):
+        shm = None
+        try:
+            if audio is not None:
+                shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+                np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+                request = {**request, "shm": shm.name, "length": len(audio)}
+            with Client(self.address, family="AF_UNIX", authkey=self.authkey) as conn:
+                conn.send({**request, "model": self.model_key})
+                reply = conn.recv()
+        except (OSError, EOFError) as e:
+            raise RuntimeError(f"inference server at {self.address} is not reachable: {e!r}") from e
+        except AuthenticationError as e:
+            raise RuntimeError(f"inference server at {self.address} rejected the key: {e!r}") from e
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        if "error" in reply:
+            raise RuntimeError(f"inference server: {reply['error']}")
+        return reply
+
+    @staticmethod
+    def _as_audio(audio):
+        if not isinstance(audio, np.ndarray):
+            from faster_whisper import decode_audio
+            audio = decode_audio(str(audio))
+        return np.ascontiguousarray(audio, dtype=np.float32)
+
+    def transcribe(self, audio, **options):
+        reply = self._call({"op": "transcribe", "options": options}, self._as_audio(audio))
+        segments = [SimpleNamespace(**segment) for segment in reply["segments"]]
+        return iter(segments), SimpleNamespace(**reply["info"])
+
+    def align_script(self, audio, script):
+        reply = self._call({"op": "align", "script": script}, self._as_audio(audio))
+        if reply["words"] is None:
+            return None
+        return [WordAlignment(**word) for word in reply["words"]]
+
+    def stats(self):
+        return self._call({"op": "stats"})["models"]
+
+
+
+import functools
+import json
+import os
+
+import streamlit as st
+
+from asr_common import ModelRegistry
+
+# calibrate_model.py がこのホスト向けに選んだ設定
+ASR_CONFIG_PATH = os.environ.get("ASR_CONFIG", "asr_config.json")
+ASR_CONFIG_DEFAULTS = {"model_size": "small", "compute_type": "int8", "cpu_threads": 0, "num_workers": 1}
+
+@st.cache_resource
+def get_asr_config(path=ASR_CONFIG_PATH):
+    """Model configuration read once per server process; the defaults when not calibrated."""
+    try:
+        with open(path) as f:
+            config = {**ASR_CONFIG_DEFAULTS, **json.load(f)}
+    except FileNotFoundError:
+        return dict(ASR_CONFIG_DEFAULTS)
+    print(f"ASR config from {path}: {config['model_size']}/{config['compute_type']} "
+          f"threads={config['cpu_threads']} workers={config['num_workers']}")
+    return config
+
+
+def load_whisper_model(model_size, device, compute_type, cpu_threads=0, num_workers=1):
+    if ASR_INFERENCE_SOCKET:
+        return RemoteWhisperModel(ASR_INFERENCE_SOCKET, (model_size, device, compute_type))
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device=device, compute_type=compute_type,
+                        cpu_threads=cpu_threads, num_workers=num_workers)
+
+@st.cache_resource
+def get_model_registry():
+    config = get_asr_config()
+    loader = functools.partial(
+        load_whisper_model, cpu_threads=config["cpu_threads"], num_workers=config["num_workers"])
+    return ModelRegistry(loader, metrics=get_metrics())
+
+def model_registry_sidebar(registry):
+    st.sidebar.subheader("ASR models")
+    if ASR_INFERENCE_SOCKET:
+        st.sidebar.caption(f"inference server: {ASR_INFERENCE_SOCKET}")
+    for stat in registry.stats():
+        st.sidebar.caption(f"{stat['model']}: load {stat['load_seconds']}s, {stat['resident_mb']} MiB")
+
+
+
+import importlib
+import os
+import threading
+import time
+
+import numpy as np
+import streamlit as st
+
+# サーバー起動後最初のスクリプト実行でモデルの読み込みと試し変換を始める (ASR_PRELOAD=0 で無効)
+ASR_PRELOAD = os.environ.get("ASR_PRELOAD", "1") == "1"
+
+def warm_up_model(model):
+    """One throwaway decode, so the first real take does not pay for allocations and kernel setup."""
+    audio = np.random.default_rng(0).normal(0, 0.01, WHISPER_SAMPLE_RATE).astype(np.float32)
+    segments, _ = model.transcribe(audio, **TRANSCRIBE_OPTIONS)
+    for _ in segments:
+        pass
+
+class Warmup:
+    """Background preparation run once per server process.
+
+    Imports the heavy modules the script itself imports lazily, loads the
+    model into the shared registry and runs one dummy decode, recording how
+    long each step took.
+    """
+
+    HEAVY_MODULES = ("faster_whisper", "streamlit_webrtc", "pydub")
+
+    def __init__(self, registry, model_key, metrics=NULL_METRICS):
+        self.model_key = model_key
+        self.import_seconds = {}
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.error = None
+        self.done = threading.Event()
+        threading.Thread(
+            target=self._run, args=(registry, metrics), name="asr-warmup", daemon=True).start()
+
+    def _run(self, registry, metrics):
+        try:
+            for name in self.HEAVY_MODULES:
+                start = time.perf_counter()
+                importlib.import_module(name)
+                self.import_seconds[name] = time.perf_counter() - start
+                metrics.observe("startup_import", self.import_seconds[name], module=name)
+
+            start = time.perf_counter()
+            model = registry.get(*self.model_key)
+            self.load_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            warm_up_model(model)
+            self.warmup_seconds = time.perf_counter() - start
+            metrics.observe("model_warmup", self.warmup_seconds, model="/".join(self.model_key))
+            print(f"Warmup: {self.model_key} ready (load {self.load_seconds:.2f}s, warm-up {self.warmup_seconds:.2f}s)")
+        except Exception as e:
+            self.error = e
+            print(f"Warmup: failed ({e!r})")
+        finally:
+            self.done.set()
+
+@st.cache_resource
+def get_warmup(model_key):
+    return Warmup(get_model_registry(), model_key, get_metrics())
+
+def asr_model(model_key=None):
+    """The session's model (or `model_key`). Waits for the warm-up, so no take races the dummy decode."""
+    model_key = model_key or st.session_state["ASR_MODEL_KEY"]
+    if ASR_PRELOAD:
+        get_warmup(model_key).done.wait()
+    return get_model_registry().get(*model_key)
+
+def startup_sidebar(warmup):
+    st.sidebar.subheader("Startup")
+    if not warmup.done.is_set():
+        st.sidebar.caption(f"モデル準備中... {'/'.join(warmup.model_key)}")
+        return
+    if warmup.error is not None:
+        st.sidebar.caption(f"warm-up failed: {warmup.error!r}")
+        return
+    imports = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in warmup.import_seconds.items())
+    st.sidebar.caption(f"import: {imports}")
+    st.sidebar.caption(f"load {warmup.load_seconds:.2f}s, warm-up {warmup.warmup_seconds:.2f}s")
 
 
 
@@ -206,12 +1080,26 @@ def main():
     #print(whisper.__path__)
     #model_str = "tiny"
     #model_str = "base"
-    model_str = "small"
+    #model_str = "small"
     #model_str = "medium" # Streamlit Cloud ではメモリ足りない
     #model_str = "large"
     #model_str = "large-v3"
     #st.session_state["ASR_MODEL"] = whisper.load_model(model_str)
-    st.session_state["ASR_MODEL"] = WhisperModel(model_str, device="cpu", compute_type="int8")
+    #st.session_state["ASR_MODEL"] = WhisperModel(model_str, device="cpu", compute_type="int8")
+    # モデルの大きさ・compute_type は calibrate_model.py で選ぶ (asr_config.json, 無ければ small/int8)
+    asr_config = get_asr_config()
+    model_str = asr_config["model_size"]
+    registry = get_model_registry()
+    st.session_state["ASR_MODEL_KEY"] = (model_str, "cpu", asr_config["compute_type"])
+    # モデルはここでは待たない (使う所で asr_model() が読み込み・試し変換の完了を待つ)
+    if ASR_PRELOAD:
+        startup_sidebar(get_warmup(st.session_state["ASR_MODEL_KEY"]))
+    st.session_state["TRANSCRIPT_CACHE"] = get_transcript_cache(
+        RECORD_DIR / "transcripts" if TRANSCRIPT_DISK_CACHE else None)
+    model_registry_sidebar(registry)
+    transcription_queue_sidebar(get_transcription_scheduler())
+    recording_memory_sidebar(get_recording_memory())
+    transcript_cache_sidebar(st.session_state["TRANSCRIPT_CACHE"])
 
     # 問題文を読み込む
     script_file_path = Path('scripts/en.json')
@@ -253,39 +1141,68 @@ def main():
     st.markdown(f"# {question.script}")
 
     # Record
+    scoring_mode = st.sidebar.radio(
+        "採点モード", ["transcribe", "align"],
+        format_func={"transcribe": "文字起こし", "align": "原稿に整列 (高速)"}.get)
+    streaming = scoring_mode == "transcribe" and st.sidebar.checkbox("ストリーミング文字起こし", value=True)
+    two_pass = scoring_mode == "transcribe" and not streaming and st.sidebar.checkbox(
+        f"2段階文字起こし ({ASR_DRAFT_MODEL} で速報 → {model_str} で確定)")
+    st.session_state["ASR_DRAFT_MODEL_KEY"] = (ASR_DRAFT_MODEL, "cpu", "int8")
+    if two_pass and ASR_PRELOAD:
+        get_warmup(st.session_state["ASR_DRAFT_MODEL_KEY"])
     webrtc_record = WebRTCRecord()
-    webrtc_record.recording(question)
+    webrtc_record.recording(question, streaming=streaming, scoring_mode=scoring_mode, two_pass=two_pass)
 
     #print("main#10")
 
     # 次の問題へ
-    if st.button("Next >") and question.wav_file_path.exists(): # 音声ファイルがない場合 次へ行く
-        current_question = st.session_state['questions'][st.session_state['current_question_index']]
-        # トランスクリプションをバックグラウンドで開始
-        #start_transcription_thread(current_question)
-        # 次の問題へ移動
-        st.session_state["current_question_index"] += 1
+    current_question = st.session_state['questions'][st.session_state['current_question_index']]
+    recorded = current_question.transcript or stored_audio_path(question.wav_file_path).exists()
+    if st.button("Next >") and recorded: # 録音がない場合 次へ行く
+        # 録音時に変換済みでなければ、トランスクリプションをバックグラウンドで開始
+        if current_question.transcript or start_transcription_job(current_question):
+            # 次の問題へ移動
+            st.session_state["current_question_index"] += 1
+        else:
+            st.warning("サーバーが混雑しています。少し待ってからもう一度 Next > を押してください。")
 
 
     # 結果表示画面
     if st.session_state['current_question_index'] >= len(scripts):
-        score = 0
-
         st.title("結果発表")
         for question in st.session_state['questions']:
-            if question.script == question.transcript:
-                score += 1
+            # 確定版が出ていれば速報を置き換える
+            apply_refinement(question)
+
+        # 句読点・大文字小文字を無視して単語単位で照合する
+        with get_metrics().span("scoring"):
+            scores = score_questions(st.session_state['questions'])
+        score = sum(word_score.correct for word_score in scores.values())
 
+        for question in st.session_state['questions']:
+            job = question.job
             if question.transcript:
+                word_score = scores[question.script_index]
+                st.markdown(f"### 問題 {question.script_index}")
+                st.write(f"原稿：{question.script}")
+                st.write(f"結果 [{TIER_LABELS[question.tier]}]：{question.transcript}")
+                if question.tier == "draft" and job is not None and not job.finished:
+                    st.caption(f"確定版を処理中... ({job.status})")
+                st.markdown(f"照合：{word_score.to_markdown()} (WER {word_score.wer:.0%})")
+                if question.alignment:
+                    show_alignment(question.alignment)
+            elif job is not None and job.status == "failed":
                 st.markdown(f"### 問題 {question.script_index}")
                 st.write(f"原稿：{question.script}")
-                st.write(f"結果：{question.transcript}")
+                st.write(f"結果：エラー ({job.error})")
             else:
                 st.markdown(f"### 問題 {question.script_index}")
                 st.write(f"原稿：{question.script}")
-                st.write(f"結果：処理中...")
+                st.write(f"結果：処理中... ({job.status if job else 'queued'})")
 
         st.markdown(f"# あなたのスコアは... {score} 点！")
+        if scores:
+            st.write(f"単語誤り率 (WER)：{corpus_wer(scores.values()):.1%}")
 
         # スレッドが完了した後にボタンを表示
         if st.button("画面を更新"):
@@ -0,0 +1,147 @@
+"""Out-of-process inference server for faster-whisper-english.py.
+
+Owns the WhisperModel instances for the whole host, so model compute does
+not compete with the Streamlit / WebRTC event loops for the GIL, a crash
+in the model does not take the web server down, and every session shares
+one copy of each model. Clients connect over a Unix socket
+(multiprocessing.connection) and pass the audio as a shared-memory block.
+
+The socket and the key clients authenticate with live in a directory only
+this user can open ($XDG_RUNTIME_DIR/asr-inference-<uid>, or under the temp
+dir). The key is ASR_INFERENCE_AUTHKEY if set, otherwise it is generated
+into the `authkey` file there on first start; clients of the same user read it.
+
+    python inference_server.py   # prints the socket path
+    ASR_INFERENCE_SOCKET=<socket> streamlit run faster-whisper-english.py
+"""
+import argparse
+import dataclasses
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Listener
+
+import numpy as np
+from faster_whisper import WhisperModel
+
+from app_loader import load_app
+from asr_common import ModelRegistry
+
+# the app must load its models here, not connect to this server
+os.environ.pop("ASR_INFERENCE_SOCKET", None)
+
+
+def attach_audio(request):
+    shm = shared_memory.SharedMemory(name=request["shm"])
+    # the client owns (and unlinks) the block; keep our resource tracker from unlinking it too
+    resource_tracker.unregister(shm._name, "shared_memory")
+    audio = np.ndarray((request["length"],), dtype=np.float32, buffer=shm.buf)
+    return shm, audio
+
+
+class InferenceServer:
+    def __init__(self, app, cpu_threads, num_workers):
+        self.app = app
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.registry = ModelRegistry(self.load_model)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def load_model(self, model_size, device, compute_type):
+        # num_workers: concurrent transcribe() calls of one model run in parallel
+        return WhisperModel(model_size, device=device, compute_type=compute_type,
+                            cpu_threads=self.cpu_threads, num_workers=self.num_workers)
+
+    def dispatch(self, request):
+        op = request["op"]
+        model = self.registry.get(*request["model"])
+        if op == "load":
+            return {"pid": os.getpid()}
+        if op == "stats":
+            return {"models": self.registry.stats()}
+
+        shm, audio = attach_audio(request)
+        try:
+            if op == "transcribe":
+                segments, info = model.transcribe(audio, **request["options"])
+                # segments is a generator: decode while the shared memory is attached
+                segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+                info = {
+                    "language": info.language,
+                    "language_probability": info.language_probability,
+                    "duration": info.duration,
+                }
+                return {"segments": segments, "info": info}
+            if op == "align":
+                words = self.app.align_script(audio, model, request["script"])
+                return {"words": None if words is None else [dataclasses.asdict(w) for w in words]}
+            raise ValueError(f"unknown op {op!r}")
+        finally:
+            del audio
+            shm.close()
+
+    def handle(self, conn):
+        with conn:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            start = time.perf_counter()
+            try:
+                reply = self.dispatch(request)
+            except Exception as e:
+                reply = {"error": repr(e)}
+            with self._lock:
+                self.requests += 1
+            print(f"{request['op']} {'/'.join(request['model'])}: {time.perf_counter() - start:.3f}s"
+                  f"{' (' + reply['error'] + ')' if 'error' in reply else ''}")
+            conn.send(reply)
+
+    def serve(self, address, authkey):
+        with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+            print(f"listening on {address} (pid {os.getpid()})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError as e:
+                    print(f"rejected a client: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=os.environ.get("ASR_INFERENCE_SERVER_SOCKET"),
+                        help="default: inference.sock in the private runtime directory")
+    parser.add_argument("--cpu-threads", type=int, default=0, help="per model; 0: ctranslate2 default")
+    parser.add_argument("--num-workers", type=int, default=2, help="parallel requests per model")
+    parser.add_argument("--preload", nargs="*", default=[], metavar="SIZE",
+                        help="models to load and warm up before accepting clients, e.g. small")
+    args = parser.parse_args()
+
+    app = load_app()
+    server = InferenceServer(app, args.cpu_threads, args.num_workers)
+    for model_size in args.preload:
+        model = server.registry.get(model_size)
+        start = time.perf_counter()
+        app.warm_up_model(model)
+        print(f"warmed up {model_size} in {time.perf_counter() - start:.2f}s")
+
+    if args.socket is None:
+        args.socket = str(app.inference_runtime_dir() / "inference.sock")
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    authkey = app.inference_authkey(create=True)
+    try:
+        server.serve(args.socket, authkey)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
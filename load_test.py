@@ -0,0 +1,318 @@
+"""Loopback load test: many students recording and being transcribed at once.
+
+Each simulated student is a pair of aiortc peers in this process, connected
+over localhost with no STUN server. The sender streams fixture speech as
+20 ms Opus frames in real time, like a browser. The receiver feeds every
+decoded frame to FrameRecorder.on_frame and calls on_ended when the track
+ends, which is what the `sendonly-audio` streamer of WebRTCRecord does. When
+the fixture ends the student "presses stop": the take is trimmed and
+converted on that session's own thread, like the script thread does, then
+transcribed through the app's shared TranscriptionScheduler and
+cached_transcribe. A take the full queue turns away (SchedulerBusy) counts
+as an error. The transcript cache keeps nothing unless --cache-entries is
+set, since every student says the same fixture.
+
+For every step of --sessions, all students record --takes takes each. The
+report shows the frame drop rate, the stop -> transcript latency
+percentiles, CPU use and peak RSS. The first step over --max-p95 or
+--max-drop is reported as the saturation point. Senders run in this
+process too, so their Opus encoding counts against the CPU. One JSON
+object per step is appended to --output.
+
+    python load_test.py --sessions 1 2 4 8 16 --model tiny
+    python load_test.py --fixture sample.wav --model none   # transport and recording only
+    ASR_INFERENCE_SOCKET=<socket of inference_server.py> python load_test.py --sessions 4 8 16 32
+"""
+import argparse
+import asyncio
+import fractions
+import functools
+import json
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import av
+import numpy as np
+from aiortc import MediaStreamTrack, RTCConfiguration, RTCPeerConnection
+from aiortc.mediastreams import MediaStreamError
+
+from app_loader import load_app
+from asr_common import (
+    BUFFER_RAM_BYTES, MAX_TAKE_SECONDS, NULL_METRICS, WHISPER_SAMPLE_RATE, FrameRecorder, RecordingMemory,
+    current_rss_bytes, find_speech_bounds, get_transcription_scheduler, to_whisper_audio,
+)
+from bench_pipeline import FRAME_RATE, FRAME_SAMPLES, git_revision, load_fixture, synthetic_speech
+
+STALL_SECONDS = 0.1  # a gap between received frames longer than this counts as a stall
+
+
+class FixtureTrack(MediaStreamTrack):
+    """Plays 48kHz stereo int16 PCM as 20 ms frames, paced in real time.
+
+    `tail_seconds` of silence follow the speech and are not counted in
+    `frames_sent`: the encoder and jitter buffer hold back the last few
+    frames until newer ones push them out, so without a tail every take
+    would lose its end, however idle the server is.
+    """
+
+    kind = "audio"
+
+    def __init__(self, pcm, tail_seconds=0.2):
+        super().__init__()
+        self.speech_samples = len(pcm) // FRAME_SAMPLES * FRAME_SAMPLES
+        tail = np.zeros((int(tail_seconds * FRAME_RATE) // FRAME_SAMPLES * FRAME_SAMPLES, pcm.shape[1]), pcm.dtype)
+        self.pcm = np.concatenate([pcm[:self.speech_samples], tail])
+        self.frames_sent = 0
+        self.finished = asyncio.Event()
+        self._pos = 0
+        self._start = None
+
+    async def recv(self):
+        if self._pos >= self.speech_samples:
+            self.finished.set()
+        if self._pos >= len(self.pcm):
+            raise MediaStreamError
+        if self._start is None:
+            self._start = time.perf_counter()
+        else:
+            wait = self._start + self._pos / FRAME_RATE - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        chunk = np.ascontiguousarray(self.pcm[self._pos:self._pos + FRAME_SAMPLES])
+        frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format="s16", layout="stereo")
+        frame.sample_rate = FRAME_RATE
+        frame.pts = self._pos
+        frame.time_base = fractions.Fraction(1, FRAME_RATE)
+        if self._pos < self.speech_samples:
+            self.frames_sent += 1
+        self._pos += FRAME_SAMPLES
+        return frame
+
+
+async def connect(track):
+    """Sender / receiver peer pair over localhost; returns them and the receiver's remote track."""
+    config = RTCConfiguration(iceServers=[])
+    sender, receiver = RTCPeerConnection(config), RTCPeerConnection(config)
+    remote_track = asyncio.get_running_loop().create_future()
+    receiver.on("track", remote_track.set_result)
+    sender.addTransceiver(track, direction="sendonly")
+
+    await sender.setLocalDescription(await sender.createOffer())
+    await receiver.setRemoteDescription(sender.localDescription)
+    await receiver.setLocalDescription(await receiver.createAnswer())
+    await sender.setRemoteDescription(receiver.localDescription)
+    return sender, receiver, await remote_track
+
+
+async def sink(track, recorder, speech_samples, take_stats):
+    """Server side of create_audio_sink_track: hand every frame to the recorder."""
+    last_at = first_pts = None
+    try:
+        while True:
+            frame = await track.recv()
+            now = time.perf_counter()
+            if last_at is not None and now - last_at > STALL_SECONDS:
+                take_stats["stalls"] += 1
+            last_at = now
+            recorder.on_frame(frame)
+            # pts counts 48kHz samples from the first frame on; the silent tail is not counted
+            if first_pts is None:
+                first_pts = frame.pts
+            if frame.pts - first_pts < speech_samples:
+                take_stats["frames_received"] += 1
+    except MediaStreamError:
+        recorder.on_ended()
+
+
+def scheduled_transcribe(app, scheduler, model, model_key, cache, audio):
+    """cached_transcribe on the shared scheduler, waited for like a session waits for its job."""
+    job = scheduler.submit(app.cached_transcribe, audio, model, model_key, cache, NULL_METRICS, False)
+    job.wait()
+    if job.status != "done":
+        raise RuntimeError(f"transcription {job.status}: {job.error}")
+    return job.result
+
+
+def finish_take(app, recorder, transcribe):
+    """What WebRTCRecord.recording does after stop, minus the UI and saving the file."""
+    audio_buffer, _ = recorder.take()
+    samples, sample_rate = audio_buffer.samples, audio_buffer.sample_rate
+    start, end = find_speech_bounds(samples, sample_rate)
+    audio = to_whisper_audio(samples[start:end], sample_rate)
+    if transcribe is None:
+        return ""
+    return transcribe(audio)
+
+
+async def run_student(app, pcm, takes, transcribe, session_thread, tracker, drain, results):
+    loop = asyncio.get_running_loop()
+    recorder = FrameRecorder(
+        target_rate=WHISPER_SAMPLE_RATE, ram_budget=BUFFER_RAM_BYTES, max_seconds=MAX_TAKE_SECONDS, tracker=tracker)
+    for _ in range(takes):
+        track = FixtureTrack(pcm)
+        take_stats = {"frames_received": 0, "stalls": 0}
+        sender, receiver, remote_track = await connect(track)
+        consumer = asyncio.create_task(sink(remote_track, recorder, track.speech_samples, take_stats))
+        await track.finished.wait()
+
+        # stop: frames still in flight get `drain` seconds, then the browser hangs up
+        stopped_at = time.perf_counter()
+        while take_stats["frames_received"] < track.frames_sent and time.perf_counter() - stopped_at < drain:
+            await asyncio.sleep(0.01)
+        await sender.close()
+        await receiver.close()
+        consumer.cancel()
+
+        error = None
+        try:
+            await loop.run_in_executor(session_thread, finish_take, app, recorder, transcribe)
+        except Exception as e:
+            error = repr(e)
+        results.append({
+            "frames_sent": track.frames_sent,
+            "frames_received": take_stats["frames_received"],
+            "stalls": take_stats["stalls"],
+            "latency": time.perf_counter() - stopped_at,
+            "error": error,
+        })
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+
+
+async def sample_memory(app, tracker, peaks, interval=0.5):
+    while True:
+        stats = tracker.stats()
+        peaks["rss_bytes"] = max(peaks["rss_bytes"], current_rss_bytes())
+        peaks["recording_ram_bytes"] = max(peaks["recording_ram_bytes"], stats["ram_bytes"])
+        peaks["recording_disk_bytes"] = max(peaks["recording_disk_bytes"], stats["disk_bytes"])
+        await asyncio.sleep(interval)
+
+
+async def run_step(app, num_sessions, pcm, takes, model, model_key, cache_entries, drain, stagger):
+    tracker = RecordingMemory()
+    transcribe = None
+    if model is not None:
+        transcribe = functools.partial(scheduled_transcribe, app, get_transcription_scheduler(), model, model_key,
+                                       app.TranscriptCache(max_entries=cache_entries))
+    results = []
+    peaks = {"rss_bytes": 0, "recording_ram_bytes": 0, "recording_disk_bytes": 0}
+    # one thread per session, like Streamlit's script threads
+    session_threads = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"session-{i}")
+                       for i in range(num_sessions)]
+    sampler = asyncio.create_task(sample_memory(app, tracker, peaks))
+
+    async def student(i):
+        # students do not all press record at the same instant
+        await asyncio.sleep(stagger * i / num_sessions)
+        await run_student(app, pcm, takes, transcribe, session_threads[i], tracker, drain, results)
+
+    cpu_start, wall_start = os.times(), time.perf_counter()
+    await asyncio.gather(*(student(i) for i in range(num_sessions)))
+    cpu_end, wall = os.times(), time.perf_counter() - wall_start
+    sampler.cancel()
+    for pool in session_threads:
+        pool.shutdown()
+
+    cpu_seconds = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    sent = sum(r["frames_sent"] for r in results)
+    received = sum(r["frames_received"] for r in results)
+    latencies = [r["latency"] for r in results if r["error"] is None]
+    return {
+        "sessions": num_sessions,
+        "takes": len(results),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "busy": sum(1 for r in results if r["error"] is not None and r["error"].startswith("SchedulerBusy")),
+        "frames_sent": sent,
+        "frames_received": received,
+        "drop_rate": round(1 - received / max(sent, 1), 4),
+        "stalls": sum(r["stalls"] for r in results),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "wall_seconds": round(wall, 2),
+        # 100% = every core busy
+        "cpu_percent": round(100 * cpu_seconds / wall / (os.cpu_count() or 1), 1),
+        "peak_rss_mb": round(peaks["rss_bytes"] / 2**20, 1),
+        "peak_recording_ram_mb": round(peaks["recording_ram_bytes"] / 2**20, 2),
+        "peak_recording_disk_mb": round(peaks["recording_disk_bytes"] / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--takes", type=int, default=2, help="takes per student and step")
+    parser.add_argument("--fixture", type=Path, help="audio file to use instead of synthetic speech")
+    parser.add_argument("--seconds", type=float, default=5.0, help="length of the synthetic take")
+    parser.add_argument("--model", default="tiny", help="'none': record and convert, but do not transcribe")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--cpu-threads", type=int, default=0, help="0: ctranslate2 default")
+    parser.add_argument("--num-workers", type=int, default=2, help="parallel transcribe() calls of the model")
+    parser.add_argument("--cache-entries", type=int, default=0,
+                        help="transcript cache size; 0: every take is decoded (they all say the same thing)")
+    parser.add_argument("--drain", type=float, default=0.3, help="seconds to wait for in-flight frames at stop")
+    parser.add_argument("--stagger", type=float, default=1.0, help="spread the students' starts over this many seconds")
+    parser.add_argument("--max-p95", type=float, default=5.0, help="saturated when p95 latency [s] is above this")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="saturated when the drop rate is above this")
+    parser.add_argument("--output", type=Path, default=Path("load_results.jsonl"))
+    args = parser.parse_args()
+
+    app = load_app()
+    pcm = load_fixture(args.fixture) if args.fixture else synthetic_speech(args.seconds)
+    model = None
+    if args.model != "none":
+        start = time.perf_counter()
+        model = app.load_whisper_model(args.model, "cpu", args.compute_type, args.cpu_threads, args.num_workers)
+        app.warm_up_model(model)
+        print(f"loaded {args.model}/{args.compute_type} in {time.perf_counter() - start:.2f}s")
+
+    common = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "audio": str(args.fixture) if args.fixture else f"synthetic:{args.seconds}s",
+        "model": None if model is None else f"{args.model}/{args.compute_type}",
+        "inference_server": app.ASR_INFERENCE_SOCKET,
+    }
+
+    print(f"{'sessions':>8} {'drop':>7} {'stalls':>6} {'p50 [s]':>8} {'p95 [s]':>8} {'p99 [s]':>8} "
+          f"{'cpu':>6} {'rss [MiB]':>10} {'errors':>6}")
+    saturated_at = None
+    with args.output.open("a") as out:
+        for num_sessions in args.sessions:
+            record = {**common, **asyncio.run(
+                run_step(app, num_sessions, pcm, args.takes, model, (args.model, "cpu", args.compute_type),
+                         args.cache_entries, args.drain, args.stagger))}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            p95 = record["latency_p95"]
+            print(f"{num_sessions:>8} {record['drop_rate']:>7.2%} {record['stalls']:>6} "
+                  f"{record['latency_p50'] or float('nan'):>8.2f} {p95 or float('nan'):>8.2f} "
+                  f"{record['latency_p99'] or float('nan'):>8.2f} {record['cpu_percent']:>5.0f}% "
+                  f"{record['peak_rss_mb']:>10.0f} {record['errors']:>6}")
+            if saturated_at is None and (p95 is None or p95 > args.max_p95 or record["drop_rate"] > args.max_drop):
+                saturated_at = num_sessions
+
+    if saturated_at is None:
+        print(f"not saturated up to {args.sessions[-1]} sessions (p95 <= {args.max_p95}s, drop <= {args.max_drop:.0%})")
+    else:
+        print(f"saturated at {saturated_at} sessions (p95 > {args.max_p95}s or drop > {args.max_drop:.0%})")
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB; "
+          f"results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
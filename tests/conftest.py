@@ -0,0 +1,25 @@
+"""Shared fixtures: the apps loaded as modules (see app_loader) and their shared module."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import asr_common
+from app_loader import load_app
+
+
+@pytest.fixture(scope="session")
+def app():
+    return load_app()
+
+
+@pytest.fixture(scope="session")
+def pronounce():
+    return load_app("whisper_pronounce.py")
+
+
+@pytest.fixture(scope="session")
+def common():
+    return asr_common
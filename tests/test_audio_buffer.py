@@ -0,0 +1,118 @@
+import av
+import numpy as np
+import pytest
+
+RATE = 16000
+FRAME = 320  # 20 ms
+
+
+def frames(num_frames, channels=1, rate=RATE):
+    """Frames with a running sample counter, so the stored take can be checked exactly."""
+    layout = "mono" if channels == 1 else "stereo"
+    for i in range(num_frames):
+        counter = (np.arange(i * FRAME, (i + 1) * FRAME) % 32768).astype(np.int16)
+        pcm = np.repeat(counter[:, None], channels, axis=1)
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout=layout)
+        frame.sample_rate = rate
+        yield frame
+
+
+def expected(num_samples):
+    return (np.arange(num_samples) % 32768).astype(np.int16)
+
+
+def test_grows_in_ram_and_keeps_every_sample(common):
+    buffer = common.AudioBuffer(initial_seconds=1)
+    for frame in frames(200):
+        buffer.append_frame(frame)
+    assert len(buffer) == 200 * FRAME
+    assert buffer.duration == pytest.approx(4.0)
+    np.testing.assert_array_equal(buffer.samples[:, 0], expected(200 * FRAME))
+    assert not buffer.spilled
+    assert buffer.ram_bytes == buffer.nbytes
+    assert buffer.disk_bytes == 0
+
+
+def test_spills_to_disk_past_the_ram_budget(common):
+    # 1 s of mono int16 is 32000 bytes
+    buffer = common.AudioBuffer(initial_seconds=1, ram_budget=40000)
+    for frame in frames(100):
+        buffer.append_frame(frame)
+    assert buffer.spilled
+    assert isinstance(buffer.samples, np.memmap)
+    assert buffer.ram_bytes == 0
+    assert buffer.disk_bytes == 100 * FRAME * 2
+    np.testing.assert_array_equal(buffer.samples[:, 0], expected(100 * FRAME))
+
+    # views taken before the next resize stay valid
+    before = buffer.samples
+    for frame in frames(100):
+        buffer.append_frame(frame)
+    np.testing.assert_array_equal(before[:, 0], expected(100 * FRAME))
+
+
+def test_truncates_at_max_seconds(common):
+    buffer = common.AudioBuffer(initial_seconds=1, max_seconds=1.01)
+    for frame in frames(100):
+        buffer.append_frame(frame)
+    assert buffer.truncated
+    assert len(buffer) == int(1.01 * RATE)
+    assert buffer.nbytes <= int(1.01 * RATE) * 2
+    np.testing.assert_array_equal(buffer.samples[:, 0], expected(int(1.01 * RATE)))
+
+
+def test_spilled_file_is_sized_for_the_longest_take(common):
+    buffer = common.AudioBuffer(initial_seconds=1, ram_budget=1000, max_seconds=3)
+    for frame in frames(300):
+        buffer.append_frame(frame)
+    assert buffer.spilled and buffer.truncated
+    assert len(buffer.samples) == 3 * RATE
+    assert buffer.nbytes == 3 * RATE * 2
+
+
+def test_clear_releases_the_spill_file(common):
+    buffer = common.AudioBuffer(initial_seconds=1, ram_budget=1000, max_seconds=1)
+    for frame in frames(100):
+        buffer.append_frame(frame)
+    buffer.clear()
+    assert not buffer.spilled and not buffer.truncated
+    assert len(buffer) == 0
+    for frame in frames(10):
+        buffer.append_frame(frame)
+    assert len(buffer) == 10 * FRAME
+
+
+def test_frame_format_change_is_an_error(common):
+    buffer = common.AudioBuffer()
+    buffer.append_frame(next(frames(1)))
+    with pytest.raises(ValueError):
+        buffer.append_frame(next(frames(1, channels=2)))
+
+
+def test_resamples_to_the_target_rate(common):
+    buffer = common.AudioBuffer(target_rate=RATE)
+    for frame in frames(50, channels=2, rate=48000):
+        buffer.append_frame(frame)
+    buffer.flush()
+    assert buffer.sample_rate == RATE
+    assert buffer.channels == 1
+    assert len(buffer) == pytest.approx(50 * FRAME / 3, abs=2)
+
+
+def test_recording_memory_totals(common):
+    tracker = common.RecordingMemory()
+    spilled = common.AudioBuffer(initial_seconds=1, ram_budget=1000, tracker=tracker)
+    in_ram = common.AudioBuffer(initial_seconds=1, tracker=tracker)
+    idle = common.AudioBuffer(tracker=tracker)
+    for frame in frames(10):
+        spilled.append_frame(frame)
+        in_ram.append_frame(frame)
+    stats = tracker.stats()
+    assert stats["buffers"] == 3
+    assert stats["recording"] == 2
+    assert stats["spilled"] == 1
+    assert stats["ram_bytes"] == in_ram.nbytes
+    assert stats["disk_bytes"] == 10 * FRAME * 2
+
+    del idle
+    assert tracker.stats()["buffers"] == 2
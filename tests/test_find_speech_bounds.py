@@ -0,0 +1,53 @@
+import numpy as np
+
+RATE = 16000
+
+
+def take(*parts):
+    """(seconds, amplitude) parts of a sine take as (samples, 1) int16."""
+    chunks = []
+    for seconds, amplitude in parts:
+        t = np.arange(int(seconds * RATE)) / RATE
+        chunks.append(amplitude * np.sin(2 * np.pi * 440 * t))
+    return (np.concatenate(chunks) * 32767).astype(np.int16).reshape(-1, 1)
+
+
+def test_trims_silence_on_both_sides(common):
+    samples = take((1.0, 0.0), (2.0, 0.5), (0.5, 0.0))
+    start, end = common.find_speech_bounds(samples, RATE, pad_ms=0)
+    assert start == RATE
+    assert end == 3 * RATE
+
+
+def test_keeps_padding_around_the_voice(common):
+    samples = take((1.0, 0.0), (2.0, 0.5), (1.0, 0.0))
+    start, end = common.find_speech_bounds(samples, RATE, pad_ms=250)
+    assert start == RATE - RATE // 4
+    assert end == 3 * RATE + RATE // 4
+
+
+def test_padding_is_clipped_to_the_take(common):
+    samples = take((0.1, 0.0), (1.0, 0.5))
+    assert common.find_speech_bounds(samples, RATE, pad_ms=250) == (0, len(samples))
+
+
+def test_quiet_take_is_kept_whole(common):
+    samples = take((2.0, 0.0001))
+    assert common.find_speech_bounds(samples, RATE) == (0, len(samples))
+
+
+def test_background_noise_far_below_the_voice_is_trimmed(common):
+    # -40 dBFS hiss is above the absolute threshold, but far below the voice
+    samples = take((1.0, 0.01), (1.0, 0.8), (1.0, 0.01))
+    start, end = common.find_speech_bounds(samples, RATE, threshold_db=-60.0, pad_ms=0)
+    assert (start, end) == (RATE, 2 * RATE)
+
+
+def test_negative_pad_disables_trimming(common):
+    samples = take((1.0, 0.0), (1.0, 0.5))
+    assert common.find_speech_bounds(samples, RATE, pad_ms=-1) == (0, len(samples))
+
+
+def test_shorter_than_one_window(common):
+    samples = take((0.005, 0.5))
+    assert common.find_speech_bounds(samples, RATE) == (0, len(samples))
@@ -0,0 +1,30 @@
+from test_audio_buffer import FRAME, expected, frames
+
+
+def test_a_bad_frame_is_dropped_and_recording_continues(common):
+    recorder = common.FrameRecorder()
+    good = list(frames(3))
+    recorder.on_frame(good[0])
+    recorder.on_frame(object())  # append_frame fails on it
+    recorder.on_frame(good[1])
+    recorder.wait_stored()
+    assert recorder.frames == 2
+
+    # the drain thread may be gone by now; a new frame must still be stored
+    recorder.on_frame(good[2])
+    audio_buffer, _ = recorder.take()
+    assert audio_buffer.sample_rate == 16000
+    assert len(audio_buffer) == 3 * FRAME
+    assert audio_buffer.samples[:, 0].tolist() == expected(3 * FRAME).tolist()
+
+
+def test_take_starts_a_fresh_buffer_and_unregisters_the_finished_one(common):
+    tracker = common.RecordingMemory()
+    recorder = common.FrameRecorder(tracker=tracker)
+    for frame in frames(2):
+        recorder.on_frame(frame)
+    audio_buffer, _ = recorder.take()
+    assert len(audio_buffer) == 2 * FRAME
+    assert len(recorder) == 0
+    assert recorder.frames == 0
+    assert tracker.stats()["buffers"] == 1  # only the new, empty buffer
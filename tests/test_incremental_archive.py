@@ -0,0 +1,96 @@
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def sources(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return path
+    return write
+
+
+def contents(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {info.filename: zf.read(info) for info in zf.infolist()}
+
+
+def test_new_archive_is_an_empty_zip(pronounce, tmp_path):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    assert contents(archive.export()) == {}
+
+
+def test_added_takes_are_readable_at_any_time(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"a" * 100))
+    assert contents(archive.path) == {"a.wav": b"a" * 100}
+    archive.add("b.wav", sources("b.wav", b"b" * 100))
+    assert contents(archive.path) == {"a.wav": b"a" * 100, "b.wav": b"b" * 100}
+    assert "b.wav" in archive
+    assert archive.stale == 0
+
+
+def test_retake_replaces_the_entry_on_export(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"old" * 100))
+    archive.add("b.wav", sources("b.wav", b"b" * 100))
+    archive.add("a.wav", sources("a.wav", b"new"))
+    assert archive.stale == 1
+    before = archive.size
+
+    assert contents(archive.export()) == {"a.wav": b"new", "b.wav": b"b" * 100}
+    assert archive.stale == 0
+    assert archive.size < before
+
+
+def test_discarded_entry_is_dropped_on_export(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"a"))
+    archive.add("a.flac", sources("a.flac", b"f"))
+    archive.discard("a.wav")
+    archive.discard("missing.wav")
+    assert "a.wav" not in archive
+    assert archive.stale == 1
+    assert contents(archive.export()) == {"a.flac": b"f"}
+
+
+def test_export_without_stale_entries_does_not_rewrite(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"a"))
+    mtime = archive.path.stat().st_mtime_ns
+    assert archive.export() == archive.path
+    assert archive.path.stat().st_mtime_ns == mtime
+
+
+def test_non_ascii_names(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("録音.wav", sources("x.wav", b"x"))
+    assert contents(archive.export()) == {"録音.wav": b"x"}
+
+
+def test_metadata_is_replaced_without_rebuilding_the_takes(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"a" * 100))
+    meta = sources("meta.json", b"[1]")
+    assert contents(archive.export(meta, tmp_path / "missing.txt")) == {"a.wav": b"a" * 100, "meta.json": b"[1]"}
+    assert archive.stale == 0
+    size = archive.size
+
+    meta.write_bytes(b"[2]")
+    assert contents(archive.export(meta)) == {"a.wav": b"a" * 100, "meta.json": b"[2]"}
+    assert archive.stale == 0
+    assert archive.size == size
+
+
+def test_take_added_after_export_replaces_the_metadata(pronounce, tmp_path, sources):
+    archive = pronounce.IncrementalArchive(tmp_path / "takes.zip")
+    archive.add("a.wav", sources("a.wav", b"a"))
+    archive.export(sources("meta.json", b"[1]"))
+    archive.add("b.wav", sources("b.wav", b"b"))
+    assert contents(archive.path) == {"a.wav": b"a", "b.wav": b"b"}
+    assert "meta.json" not in archive
+    assert contents(archive.export(sources("meta.json", b"[1, 2]"))) == {
+        "a.wav": b"a", "b.wav": b"b", "meta.json": b"[1, 2]"}
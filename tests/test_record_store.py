@@ -0,0 +1,37 @@
+import sqlite3
+
+
+def test_sessions_are_deleted_by_age_with_or_without_takes(pronounce, tmp_path, monkeypatch):
+    store = pronounce.RecordStore(tmp_path / "records.sqlite3")
+    monkeypatch.setattr(pronounce.time, "time", lambda: 1000.0)
+    store.set_manuscripts("never-recorded", ["a", "b"])
+    store.set_manuscripts("recorded", ["a", "b"])
+    take = tmp_path / "take.wav"
+    take.write_bytes(b"x" * 10)
+    monkeypatch.setattr(pronounce.time, "time", lambda: 2000.0)
+    store.upsert_take("recorded", pronounce.Record(0, "a", tmp_path, wav_bytes=10), take)
+    store.set_manuscripts("fresh", ["c"])
+
+    assert store.delete_sessions_before(1500.0) == ["never-recorded"]
+    assert list(store.unrecorded("never-recorded")) == []
+    assert list(store.unrecorded("recorded")) == ["b"]
+    assert store.num_takes("recorded") == 1
+
+    assert sorted(store.delete_sessions_before(3000.0)) == ["fresh", "recorded"]
+    assert store.num_takes("recorded") == 0
+
+
+def test_database_without_updated_at_is_migrated(pronounce, tmp_path):
+    db_path = tmp_path / "records.sqlite3"
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.execute("CREATE TABLE manuscripts (session_id TEXT NOT NULL, manuscript_index INTEGER NOT NULL, "
+                     "text TEXT NOT NULL, PRIMARY KEY (session_id, manuscript_index)) WITHOUT ROWID")
+        conn.execute("INSERT INTO manuscripts VALUES ('old', 0, 'a')")
+    conn.close()
+
+    store = pronounce.RecordStore(db_path)
+    assert list(store.unrecorded("old")) == ["a"]
+    store.set_manuscripts("new", ["b"])
+    # rows from before the migration count as written at time 0
+    assert store.delete_sessions_before(1.0) == ["old"]
+    assert list(store.unrecorded("new")) == ["b"]
@@ -0,0 +1,100 @@
+import pytest
+
+
+class Placeholder:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, kind):
+        return lambda *args, **kwargs: self.calls.append((kind, args, kwargs))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(common, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(common.time, "monotonic", clock)
+    return clock
+
+
+def test_first_update_is_sent_at_once(common, clock):
+    placeholder = Placeholder()
+    common.ThrottledUpdater(placeholder, max_fps=4).update("info", "Recording", icon="x")
+    assert placeholder.calls == [("info", ("Recording",), {"icon": "x"})]
+
+
+def test_unchanged_value_is_not_sent_again(common, clock):
+    placeholder = Placeholder()
+    updater = common.ThrottledUpdater(placeholder, max_fps=4)
+    for _ in range(5):
+        updater.update("info", "same")
+        clock.now += 1
+    assert len(placeholder.calls) == 1
+    assert (updater.requested, updater.sent) == (5, 1)
+
+
+def test_updates_within_the_interval_are_coalesced(common, clock):
+    placeholder = Placeholder()
+    updater = common.ThrottledUpdater(placeholder, max_fps=4)
+    updater.update("info", "0s")
+    for i in range(1, 5):
+        clock.now += 0.06
+        updater.update("info", f"{i}s")
+    assert placeholder.calls == [("info", ("0s",), {})]
+
+    clock.now += 0.06
+    updater.update("info", "5s")
+    assert placeholder.calls[-1] == ("info", ("5s",), {})
+    assert len(placeholder.calls) == 2
+
+
+def test_flush_sends_the_latest_pending_value(common, clock):
+    placeholder = Placeholder()
+    updater = common.ThrottledUpdater(placeholder, max_fps=4)
+    updater.update("info", "a")
+    updater.update("warning", "b")
+    updater.update("info", "c")
+    updater.flush()
+    assert placeholder.calls == [("info", ("a",), {}), ("info", ("c",), {})]
+    updater.flush()
+    assert len(placeholder.calls) == 2
+
+
+def test_returning_to_the_shown_value_drops_the_pending_one(common, clock):
+    placeholder = Placeholder()
+    updater = common.ThrottledUpdater(placeholder, max_fps=4)
+    updater.update("info", "a")
+    updater.update("info", "b")
+    updater.update("info", "a")
+    updater.flush()
+    assert placeholder.calls == [("info", ("a",), {})]
+
+
+def test_no_limit_sends_every_change(common, clock):
+    placeholder = Placeholder()
+    updater = common.ThrottledUpdater(placeholder, max_fps=0)
+    for i in range(3):
+        updater.update("progress", i)
+    assert [args for _, args, _ in placeholder.calls] == [(0,), (1,), (2,)]
+    assert updater.min_interval == 0.0
+
+
+def test_report_counts_requested_and_sent(common, clock):
+    events = []
+
+    class Sink:
+        def emit(self, record):
+            events.append((record["name"], record["state"], record["value"], record["element"]))
+
+    updater = common.ThrottledUpdater(Placeholder(), max_fps=4)
+    updater.update("info", "a")
+    updater.update("info", "b")
+    updater.report(common.Metrics([Sink()]), element="status")
+    assert events == [("ui_updates", "requested", 2, "status"), ("ui_updates", "sent", 1, "status")]
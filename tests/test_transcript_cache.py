@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+MODEL_KEY = ("tiny", "cpu", "int8")
+OPTIONS = {"beam_size": 5}
+
+
+@pytest.fixture
+def audio():
+    return np.random.default_rng(0).normal(0, 0.1, 16000).astype(np.float32)
+
+
+def test_key_depends_on_audio_model_and_options(app, audio):
+    key = app.TranscriptCache.make_key(audio, MODEL_KEY, OPTIONS)
+    assert key == app.TranscriptCache.make_key(audio.copy(), MODEL_KEY, OPTIONS)
+    assert key != app.TranscriptCache.make_key(audio[:-1], MODEL_KEY, OPTIONS)
+    assert key != app.TranscriptCache.make_key(audio, ("small", "cpu", "int8"), OPTIONS)
+    assert key != app.TranscriptCache.make_key(audio, MODEL_KEY, {"beam_size": 1})
+
+
+def test_memory_hit_and_miss(app):
+    cache = app.TranscriptCache()
+    assert cache.get("a") is None
+    cache.put("a", "hello")
+    assert cache.get("a") == "hello"
+    assert cache.stats() == {"memory_hits": 1, "disk_hits": 0, "misses": 1, "entries": 1}
+
+
+def test_least_recently_used_entry_is_evicted(app):
+    cache = app.TranscriptCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_disk_tier_survives_a_new_cache(app, tmp_path):
+    app.TranscriptCache(cache_dir=tmp_path).put("a", "hello", model="tiny")
+    cache = app.TranscriptCache(cache_dir=tmp_path)
+    assert cache.get("a") == "hello"
+    assert cache.get("a") == "hello"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_unreadable_disk_entry_is_a_miss(app, tmp_path):
+    (tmp_path / "a.json").write_text("{not json")
+    assert app.TranscriptCache(cache_dir=tmp_path).get("a") is None
+
+
+def test_failed_disk_write_keeps_the_memory_entry(app, tmp_path, monkeypatch):
+    def disk_full(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(app.os, "replace", disk_full)
+    cache = app.TranscriptCache(cache_dir=tmp_path)
+    cache.put("a", "hello")
+    assert cache.get("a") == "hello"
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+
+def levenshtein(a, b):
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, y in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (x != y))
+    return row[-1]
+
+
+def test_normalize_words_ignores_case_and_punctuation(common):
+    assert common.normalize_words(" The cat, sat. ON the MAT!") == ["the", "cat", "sat", "on", "the", "mat"]
+    assert common.normalize_words("It’s 'fine'") == ["it's", "fine"]
+    assert common.normalize_words(None) == []
+
+
+def test_exact_match_is_correct(common):
+    [score] = common.score_pairs(["The cat sat."], [" the cat sat"])
+    assert score.correct
+    assert score.wer == 0
+    assert score.hits == 3
+
+
+@pytest.mark.parametrize("transcript, counts", [
+    ("the dog sat", {"substitutions": 1}),
+    ("the sat", {"deletions": 1}),
+    ("the big cat sat", {"insertions": 1}),
+    ("", {"deletions": 3}),
+])
+def test_error_kinds(common, transcript, counts):
+    [score] = common.score_pairs(["the cat sat"], [transcript])
+    expected = {"substitutions": 0, "deletions": 0, "insertions": 0, **counts}
+    assert {kind: getattr(score, kind) for kind in expected} == expected
+    assert score.errors == sum(counts.values())
+    assert score.wer == pytest.approx(score.errors / 3)
+
+
+def test_batch_matches_a_reference_edit_distance(common):
+    rng = random.Random(0)
+    vocab = ["a", "b", "c", "d"]
+    scripts = [" ".join(rng.choices(vocab, k=rng.randint(0, 8))) for _ in range(50)]
+    transcripts = [" ".join(rng.choices(vocab, k=rng.randint(0, 8))) for _ in range(50)]
+    for script, transcript, score in zip(scripts, transcripts, common.score_pairs(scripts, transcripts)):
+        assert score.errors == levenshtein(script.split(), transcript.split())
+        assert [ref for op, ref, _ in score.ops if op != "ins"] == script.split()
+        assert [hyp for op, _, hyp in score.ops if op != "del"] == transcript.split()
+
+
+def test_empty_batch(common):
+    assert common.score_pairs([], []) == []
+
+
+def test_corpus_wer_weights_by_reference_length(common):
+    scores = common.score_pairs(["one", "two three four five"], ["uno", "two three four five"])
+    assert common.corpus_wer(scores) == pytest.approx(1 / 5)
+
+
+def test_markdown_marks_errors(common):
+    [score] = common.score_pairs(["the cat sat"], ["the dog sat down"])
+    assert score.to_markdown() == "the :red[~~cat~~ dog] sat :orange[+down]"
@@ -1,6 +1,7 @@
 import hashlib
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
 @dataclass
 class Question:
@@ -8,6 +9,7 @@ class Question:
     script: str
     transcript: str
     wav_dir_path: Path
+    job: Any = None  # TranscriptionJob of the background transcription
 
     @property
     def file_id(self):
@@ -26,76 +28,77 @@ class Question:
         return {"script": self.script, "file_name": self.output_wav_name}
 
 
-import queue
+import time
 
-import pydub
 import streamlit as st
-from streamlit_webrtc import WebRtcMode, webrtc_streamer
+from streamlit_webrtc import WebRtcMode, create_audio_sink_track, webrtc_streamer
+
+from asr_common import (
+    BUFFER_RAM_BYTES, MAX_TAKE_SECONDS, WHISPER_SAMPLE_RATE, FrameRecorder, ThrottledUpdater, get_recording_memory,
+    recording_memory_sidebar, trim_take,
+)
 
 class WebRTCRecord:
     def __init__(self):
+        if "frame_recorder" not in st.session_state:
+            st.session_state["frame_recorder"] = FrameRecorder(
+                target_rate=WHISPER_SAMPLE_RATE, ram_budget=BUFFER_RAM_BYTES, max_seconds=MAX_TAKE_SECONDS,
+                tracker=get_recording_memory())
+        self.recorder = st.session_state["frame_recorder"]
+
         self.webrtc_ctx = webrtc_streamer(
             key="sendonly-audio",
             mode=WebRtcMode.SENDONLY,
-            audio_receiver_size=256,
+            sink_audio_track=create_audio_sink_track(
+                self.recorder.on_frame, key="sendonly-audio-sink", on_ended=self.recorder.on_ended),
             rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
             media_stream_constraints={
                 "audio": True,
             },
         )
 
-        if "audio_buffer" not in st.session_state:
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
-
     def recording(self, question):
         status_box = st.empty()
-
-        while True:
-            if self.webrtc_ctx.audio_receiver:
-                try:
-                    audio_frames = self.webrtc_ctx.audio_receiver.get_frames(timeout=1)
-                except queue.Empty:
-                    status_box.warning("No frame arrived.")
-                    continue
-
-                status_box.info("Now Recording...")
-
-                sound_chunk = pydub.AudioSegment.empty()
-                for audio_frame in audio_frames:
-                    sound = pydub.AudioSegment(
-                        data=audio_frame.to_ndarray().tobytes(),
-                        sample_width=audio_frame.format.bytes,
-                        frame_rate=audio_frame.sample_rate,
-                        channels=len(audio_frame.layout.channels),
-                    )
-                    sound_chunk += sound
-
-                if len(sound_chunk) > 0:
-                    st.session_state["audio_buffer"] += sound_chunk
-            else:
-                break
-
-        audio_buffer = st.session_state["audio_buffer"]
-
-        if not self.webrtc_ctx.state.playing and len(audio_buffer) > 0:
+        recorder = self.recorder
+        recorder.set_playing(self.webrtc_ctx.state.playing)
+        # 変わった値だけを、ASR_UI_MAX_FPS を超えない頻度でブラウザに送る
+        status = ThrottledUpdater(status_box)
+
+        last_frames = -1
+        last_frame_at = time.monotonic()
+        while self.webrtc_ctx.state.playing and not recorder.track_ended:
+            if recorder.frames != last_frames:
+                last_frames = recorder.frames
+                last_frame_at = time.monotonic()
+                if recorder.buffer.truncated:
+                    status.update("warning", f"最大録音時間 ({MAX_TAKE_SECONDS:.0f}秒) に達しました。録音を止めてください。")
+                else:
+                    status.update("info", f"Now Recording... ({recorder.duration:.0f}s)")
+            elif time.monotonic() - last_frame_at > 1:
+                status.update("warning", "No frame arrived.")
+                last_frame_at = time.monotonic()
+            time.sleep(status.min_interval or 0.2)
+        status.flush()
+
+        if not self.webrtc_ctx.state.playing and len(recorder) > 0:
             status_box.success("Finish Recording")
+            audio_buffer, _ = recorder.take()
+            trim_take(audio_buffer)
             try:
-                audio_buffer.export(str(question.wav_file_path), format="wav")
+                audio_buffer.export_wav(question.wav_file_path)
             except BaseException:
                 st.error("Error while Writing wav to disk")
 
-            # Reset
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
-
 
 
 
 
 
-import threading
 import whisper
 import streamlit as st
 
+from asr_common import SchedulerBusy, get_transcription_scheduler
+
 def format_string(s):
     s = s.replace(',', '')
     s = s.replace('.', '')
@@ -103,25 +106,114 @@ def format_string(s):
     return s
 
 def transcribe(file_path, model):
-    result = model.transcribe(str(file_path), verbose=True)
+    # ffmpeg での読み込みは並列でよいが、デコードは 1 モデルにつき 1 本ずつ
+    # (openai-whisper は kv-cache をモデルのフックに持つので、同時に走らせると壊れる)
+    audio = whisper.load_audio(str(file_path))
+    with model.decode_lock:
+        result = model.transcribe(audio, verbose=True)
     return format_string(result["text"])
 
-def async_transcribe(question, model):
-    transcript = transcribe(question.wav_file_path, model)
-    question.transcript = transcript
+def async_transcribe(file_path, model):
+    return transcribe(file_path, model)
 
-def start_transcription_thread(question):
+def start_transcription_job(question):
+    """Queue `question` on the shared scheduler. Returns False when it is busy."""
+    if question.job is not None and not question.job.finished:
+        question.job.cancel()
     model = st.session_state["ASR_MODEL"]
-    x = threading.Thread(target=async_transcribe, args=(question, model))
-    x.start()
+    try:
+        question.job = get_transcription_scheduler().submit(async_transcribe, question.wav_file_path, model)
+    except SchedulerBusy as e:
+        print(f"start_transcription_job: busy ({e})")
+        return False
+    # 終わったら結果画面に知らせる (ワーカースレッドからは session_state に触れないので Event を渡す)
+    job_done = st.session_state["job_done"]
+    question.job.add_done_callback(lambda job: job_done.set())
+    return True
+
+
+
+import threading
+
+import streamlit as st
+
+from asr_common import ModelRegistry
+
+def load_whisper_model(model_size, device, compute_type):
+    # openai-whisper has no compute_type; it is kept in the key for symmetry
+    model = whisper.load_model(model_size, device=device)
+    # serializes transcribe() on this model across the scheduler's workers
+    model.decode_lock = threading.Lock()
+    return model
+
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry(load_whisper_model)
 
+def model_registry_sidebar(registry):
+    st.sidebar.subheader("ASR models")
+    for stat in registry.stats():
+        st.sidebar.caption(f"{stat['model']}: load {stat['load_seconds']}s, {stat['resident_mb']} MiB")
 
 
+
+import threading
+
 import streamlit as st
 from pathlib import Path
 #from question import Question
 import json
 
+from asr_common import corpus_wer, score_questions, transcription_queue_sidebar
+
+def watch_jobs(results_box):
+    """Run by run_every while transcriptions are pending. Draws nothing on its own:
+    only when a job has finished since the last draw, it redraws the results list
+    into results_box (outside this fragment), so the rest of the page is left alone."""
+    if st.session_state["job_done"].is_set():
+        results_page(results_box)
+
+def results_page(results_box):
+    """Draw the results list into results_box (an st.empty), with the finished
+    transcriptions filled in. Redrawing replaces the previous list."""
+    # clear before reading the jobs: a job finishing after this point sets it again
+    st.session_state["job_done"].clear()
+
+    with results_box.container():
+        results_list()
+
+def results_list():
+    st.title("結果発表")
+    for question in st.session_state['questions']:
+        job = question.job
+        if job is not None and job.status == "done" and not question.transcript:
+            question.transcript = job.result
+
+    # 句読点・大文字小文字を無視して単語単位で照合する
+    scores = score_questions(st.session_state['questions'])
+    score = sum(word_score.correct for word_score in scores.values())
+
+    for question in st.session_state['questions']:
+        job = question.job
+        if question.transcript:
+            word_score = scores[question.script_index]
+            st.markdown(f"### 問題 {question.script_index}")
+            st.write(f"原稿：{question.script}")
+            st.write(f"結果：{question.transcript}")
+            st.markdown(f"照合：{word_score.to_markdown()} (WER {word_score.wer:.0%})")
+        elif job is not None and job.status == "failed":
+            st.markdown(f"### 問題 {question.script_index}")
+            st.write(f"原稿：{question.script}")
+            st.write(f"結果：エラー ({job.error})")
+        else:
+            st.markdown(f"### 問題 {question.script_index}")
+            st.write(f"原稿：{question.script}")
+            st.write(f"結果：処理中... ({job.status if job else 'queued'})")
+
+    st.markdown(f"# あなたのスコアは... {score} 点！")
+    if scores:
+        st.write(f"単語誤り率 (WER)：{corpus_wer(scores.values()):.1%}")
+
 def main():
 
     # 録音ファイルの保存先の設定
@@ -130,11 +222,17 @@ def main():
 
     # whisper model
     print(whisper.__path__)
-    st.session_state["ASR_MODEL"] = whisper.load_model("base")
+    registry = get_model_registry()
+    st.session_state["ASR_MODEL"] = registry.get("base", device="cpu", compute_type="fp32")
+    model_registry_sidebar(registry)
+    transcription_queue_sidebar(get_transcription_scheduler())
+    recording_memory_sidebar(get_recording_memory())
 
     # セッション状態の管理
     if 'current_question_index' not in st.session_state:
         st.session_state['current_question_index'] = 0
+    if "job_done" not in st.session_state:
+        st.session_state["job_done"] = threading.Event()
 
     # 問題文を読み込む
     script_file_path = Path('scripts/en.json')
@@ -163,54 +261,41 @@ def main():
     print(f"st.session_state['current_question_index']: {st.session_state['current_question_index']}")
     print(f"st.session_state['questions']: {st.session_state['questions']}")
 
-    # 現在の問題を取得
-    question = Question(
-        script_index = st.session_state["current_question_index"],
-        script = scripts[st.session_state['current_question_index']],
-        transcript = "",
-        wav_dir_path = RECORD_DIR,
-    )
+    # 現在の問題を取得 (全問終わったら録音欄は出さない)
+    if st.session_state['current_question_index'] < len(scripts):
+        question = Question(
+            script_index = st.session_state["current_question_index"],
+            script = scripts[st.session_state['current_question_index']],
+            transcript = "",
+            wav_dir_path = RECORD_DIR,
+        )
 
-    # 読み上げ文を表示
-    st.markdown(f"# {question.script}")
+        # 読み上げ文を表示
+        st.markdown(f"# {question.script}")
 
-    # Record
-    webrtc_record = WebRTCRecord()
-    webrtc_record.recording(question)
+        # Record
+        webrtc_record = WebRTCRecord()
+        webrtc_record.recording(question)
 
 
-    # 次の問題へ
-    if st.button("Next >") and question.wav_file_path.exists(): # 音声ファイルがない場合 次へ行く
-        current_question = st.session_state['questions'][st.session_state['current_question_index']]
-        # トランスクリプションをバックグラウンドで開始
-        start_transcription_thread(current_question)
-        # 次の問題へ移動
-        st.session_state["current_question_index"] += 1
+        # 次の問題へ
+        if st.button("Next >") and question.wav_file_path.exists(): # 音声ファイルがない場合 次へ行く
+            current_question = st.session_state['questions'][st.session_state['current_question_index']]
+            # トランスクリプションをバックグラウンドで開始
+            if start_transcription_job(current_question):
+                # 次の問題へ移動
+                st.session_state["current_question_index"] += 1
+            else:
+                st.warning("サーバーが混雑しています。少し待ってからもう一度 Next > を押してください。")
 
 
     # 結果表示画面
     if st.session_state['current_question_index'] >= len(scripts):
-        score = 0
-
-        st.title("結果発表")
-        for question in st.session_state['questions']:
-            if question.script == question.transcript:
-                score += 1
-
-            if question.transcript:
-                st.markdown(f"### 問題 {question.script_index}")
-                st.write(f"原稿：{question.script}")
-                st.write(f"結果：{question.transcript}")
-            else:
-                st.markdown(f"### 問題 {question.script_index}")
-                st.write(f"原稿：{question.script}")
-                st.write(f"結果：処理中...")
-
-        st.markdown(f"# あなたのスコアは... {score} 点！")
-
-        # スレッドが完了した後にボタンを表示
-        if st.button("画面を更新"):
-            st.rerun()
+        results_box = st.empty()
+        results_page(results_box)
+        # 処理中の文字起こしがある間だけ、1 秒ごとに完了を確かめる (完了したときだけ結果欄を描き直す)
+        if any(q.job is not None and not q.job.finished for q in st.session_state['questions']):
+            st.fragment(watch_jobs, run_every=1.0)(results_box)
 
 
 if __name__ == "__main__":
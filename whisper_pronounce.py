@@ -1,4 +1,4 @@
-import shutil
+import uuid
 
 import streamlit as st
 
@@ -32,12 +32,15 @@ class UI_Main:
 
 
     def audio_player_if_exists(self, output_file_path):
+        # FLAC などで保存されていればそちらを再生する
+        output_file_path = stored_audio_path(output_file_path)
         print(f"UI_Main:audio_player_if_exists ({output_file_path.exists()})")
         if output_file_path.exists():
             with output_file_path.open("rb") as f:
                 audio_bytes = f.read()
 
-            st.audio(audio_bytes)
+            mime = {suffix: mime for _, suffix, mime in STORAGE_FORMATS.values()}[output_file_path.suffix]
+            st.audio(audio_bytes, format=mime)
 
 ui_main = UI_Main()
 
@@ -68,20 +71,35 @@ class UI_Sidebar:
         st.sidebar.write(f"{current_num} / {total_num}")
 
 
+    def recording_memory_stats(self) -> None:
+        recording_memory_sidebar(get_recording_memory(), settings.max_take_seconds)
+
+
     def has_at_least_one_wav_file(self):
         return st.session_state["counter"].total
 
 
     def proceed_to_download(self, settings):
         if st.sidebar.button("Proceed to download"):
-            st.session_state["records"].export_record_info_as_json(settings.record_info_path)
-            st.session_state["records"].export_unrecorded_texts_as_json(settings.unrecorded_texts_path)
-            st.session_state["records"].compress_wav_files_into_zip(settings.archive_filename, settings.wav_dir_path)
+            # メタデータはセッションのディレクトリに書き出す
+            st.session_state["records"].prepare_session_dir()
+            session_dir = st.session_state["records"].session_dir
+            record_info_path = session_dir / settings.record_info_path.name
+            unrecorded_texts_path = session_dir / settings.unrecorded_texts_path.name
+            st.session_state["records"].export_record_info_as_json(record_info_path)
+            st.session_state["records"].export_unrecorded_texts_as_json(unrecorded_texts_path)
+            # 録音は保存のたびにアーカイブへ追加済み。撮り直し・削除で古くなったエントリは
+            # ここで 1 度だけ取り除き、メタデータは末尾だけ差し替える
+            archive_path = st.session_state["records"].archive.export(record_info_path, unrecorded_texts_path)
             num_wav_files = st.session_state["records"].num_wav_files
 
             st.sidebar.write("Archive Stats:")
             st.sidebar.write(f"- Num. of wav files {num_wav_files}")
-            with open(settings.archive_filename, "rb") as fp:
+            st.sidebar.write(f"- Archive size {archive_path.stat().st_size / 1e6:.1f} MB")
+            stored_bytes, wav_bytes = st.session_state["records"].storage_stats()
+            if wav_bytes:
+                st.sidebar.write(f"- Storage {stored_bytes / 1e6:.1f} MB ({stored_bytes / wav_bytes:.0%} of WAV)")
+            with archive_path.open("rb") as fp:
                 st.sidebar.download_button(
                     label="Download", data=fp, file_name=settings.archive_filename, mime="application/zip"
                 )
@@ -92,6 +110,8 @@ ui_sidebar = UI_Sidebar()
 # config
 ###############################
 from pathlib import Path
+from typing import Optional
+
 from pydantic import BaseSettings
 
 class TojiSettings(BaseSettings):
@@ -99,6 +119,22 @@ class TojiSettings(BaseSettings):
     record_info_path: Path = wav_dir_path / "meta.json"
     unrecorded_texts_path: Path = wav_dir_path / "unrecorded.txt"
     archive_filename: str = "toji_wav_archive.zip"
+    # 全セッションの録音情報 (セッションごとの録音は wav_dir_path/<session_id>/ に保存)
+    record_db_path: Path = wav_dir_path / "records.sqlite3"
+    # 保存形式 (wav / flac / opus)。wav 以外は録音後にバックグラウンドでエンコードする
+    storage_codec: str = "wav"
+    # 録音前後の無音カット。trim_pad_ms < 0 で無効
+    trim_pad_ms: int = 250
+    trim_threshold_db: float = -45.0
+    # 1 テイクをメモリに置く上限 (超えたら一時ファイルの memmap に移す) と最大録音時間
+    buffer_ram_mb: float = 4.0
+    max_take_seconds: float = 300.0
+    # memmap の置き場所 (None: tempfile の既定)
+    buffer_spill_dir: Optional[Path] = None
+    # 画面更新の上限 (回/秒)。録音中の状態表示はこれ以上頻繁に送らない。0 で無制限
+    ui_max_fps: float = 4.0
+    # この時間 (時間単位) 更新のないセッションのディレクトリと録音情報は消す。0 以下で無効
+    session_max_age_hours: float = 24 * 7
 
     class Config:
         env_prefix = "toji_"
@@ -112,16 +148,24 @@ settings = TojiSettings()
 ###############################
 import hashlib
 import json
+import shutil
+import sqlite3
+import threading
+import time
+import warnings
 import zipfile
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List
+from typing import List, Optional
+
+import streamlit as st
 
 @dataclass
 class Record:
     manuscript_index: int
     text: str
     wav_dir_path: Path
+    wav_bytes: int = 0  # size of the take as WAV, to report the storage savings
 
     @property
     def file_id(self):
@@ -136,46 +180,301 @@ class Record:
         return self.wav_dir_path / self.output_wav_name
 
     @property
-    def record_info(self):
-        return {"text": self.text, "file_name": self.output_wav_name}
+    def stored_file_path(self):
+        return stored_audio_path(self.wav_file_path)
+
+class IncrementalArchive:
+    """ZIP archive kept up to date take by take, ready to download at any time.
+
+    WAV barely compresses, so entries are stored without compression. Adding
+    a take appends it with zipfile's append mode, which costs one copy of
+    that take plus rewriting the central directory. A re-take or a discard
+    only marks the old entry stale; `export()` rebuilds the archive without
+    the stale entries, once, when it is downloaded.
+
+    Metadata files change on every export, so they are not takes: `export()`
+    writes them after the last take, and the next `add()` or `export()` cuts
+    them off again, which leaves the takes untouched.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.arcnames = set()  # live entries
+        self.stale = 0  # superseded or discarded entries still in the file
+        self._metadata_offset = None  # where the trailing metadata entries start
+        self._lock = threading.Lock()
+        zipfile.ZipFile(self.path, "w").close()
+
+    def __contains__(self, arcname):
+        return arcname in self.arcnames
+
+    @property
+    def size(self):
+        return self.path.stat().st_size
+
+    def _drop_metadata(self, zf):
+        # the metadata entries are the last ones: forget them and write over them
+        if self._metadata_offset is None:
+            return
+        zf.filelist = [info for info in zf.filelist if info.header_offset < self._metadata_offset]
+        zf.NameToInfo = {info.filename: info for info in zf.filelist}
+        zf.start_dir = self._metadata_offset
+        self._metadata_offset = None
+
+    def add(self, arcname, source):
+        with self._lock:
+            if arcname in self.arcnames:
+                self.stale += 1
+            with warnings.catch_warnings():
+                # the older entry of the same name is dropped by export()
+                warnings.filterwarnings("ignore", "Duplicate name", UserWarning)
+                with zipfile.ZipFile(self.path, "a", zipfile.ZIP_STORED) as zf:
+                    self._drop_metadata(zf)
+                    zf.write(source, arcname)
+            self.arcnames.add(arcname)
+
+    def discard(self, arcname):
+        with self._lock:
+            if arcname in self.arcnames:
+                self.arcnames.remove(arcname)
+                self.stale += 1
+
+    def export(self, *metadata_paths):
+        """Path of the archive with only the live entries, rebuilt if anything went stale.
+
+        The metadata files that exist are put after the takes, replacing the
+        ones of the previous export.
+        """
+        with self._lock:
+            if self.stale:
+                tmp_path = self.path.with_suffix(".tmp")
+                with zipfile.ZipFile(self.path) as src, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as dst:
+                    # for duplicate names the last entry is the current one
+                    latest = {info.filename: info for info in src.infolist() if info.filename in self.arcnames}
+                    for info in latest.values():
+                        with src.open(info) as fin, dst.open(info, "w") as fout:
+                            shutil.copyfileobj(fin, fout, 1024 * 1024)
+                tmp_path.replace(self.path)
+                self.stale = 0
+                self._metadata_offset = None
+            if metadata_paths or self._metadata_offset is not None:
+                with zipfile.ZipFile(self.path, "a", zipfile.ZIP_STORED) as zf:
+                    self._drop_metadata(zf)
+                    metadata_offset = zf.start_dir
+                    for metadata_path in metadata_paths:
+                        if metadata_path.exists():
+                            zf.write(metadata_path, metadata_path.name)
+                self._metadata_offset = metadata_offset
+            return self.path
+
+class RecordStore:
+    """SQLite store of the takes of every session, shared by the whole server.
+
+    A take is one row keyed by (session_id, manuscript_index): a re-take is
+    an upsert, and no file is rewritten as sessions accumulate. WAL mode
+    keeps a crash from losing committed takes and lets exports read while
+    takes are written. Exports stream rows from their own connection.
+    Every row carries the time it was last written, so sessions that are
+    gone can be dropped by age with `delete_sessions_before`.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS manuscripts (
+        session_id TEXT NOT NULL,
+        manuscript_index INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        updated_at REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (session_id, manuscript_index)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS takes (
+        session_id TEXT NOT NULL,
+        manuscript_index INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        wav_bytes INTEGER NOT NULL,
+        stored_bytes INTEGER NOT NULL,
+        recorded_at REAL NOT NULL,
+        PRIMARY KEY (session_id, manuscript_index)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # updated_at が無い古いデータベースに列を足す (既存の行は 0 = とても古い扱い)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(manuscripts)")}
+        if "updated_at" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE manuscripts ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _stream(self, sql, params=()):
+        conn = sqlite3.connect(str(self.db_path))
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def set_manuscripts(self, session_id, texts):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM manuscripts WHERE session_id = ? AND manuscript_index >= ?", (session_id, len(texts)))
+            now = time.time()
+            self._conn.executemany(
+                "INSERT INTO manuscripts (session_id, manuscript_index, text, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (session_id, manuscript_index) DO UPDATE SET "
+                "text = excluded.text, updated_at = excluded.updated_at",
+                [(session_id, i, text, now) for i, text in enumerate(texts)],
+            )
+
+    def upsert_take(self, session_id, record, file_path):
+        self._execute(
+            "INSERT INTO takes VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id, manuscript_index) DO UPDATE SET "
+            "text = excluded.text, file_name = excluded.file_name, wav_bytes = excluded.wav_bytes, "
+            "stored_bytes = excluded.stored_bytes, recorded_at = excluded.recorded_at",
+            (session_id, record.manuscript_index, record.text, file_path.name,
+             record.wav_bytes, file_path.stat().st_size, time.time()),
+        )
+
+    def num_takes(self, session_id):
+        return self._execute("SELECT COUNT(*) FROM takes WHERE session_id = ?", (session_id,))[0][0]
+
+    def storage_stats(self, session_id):
+        """(bytes on disk, bytes the same takes would take as WAV)."""
+        stored, wav = self._execute(
+            "SELECT COALESCE(SUM(stored_bytes), 0), COALESCE(SUM(wav_bytes), 0) FROM takes WHERE session_id = ?",
+            (session_id,))[0]
+        return stored, wav
+
+    def delete_session(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM takes WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM manuscripts WHERE session_id = ?", (session_id,))
+
+    def delete_sessions_before(self, cutoff):
+        """Delete every session whose rows were all written before `cutoff` (epoch seconds). Returns their ids."""
+        with self._lock, self._conn:
+            session_ids = [session_id for (session_id,) in self._conn.execute(
+                "SELECT session_id FROM ("
+                "SELECT session_id, updated_at AS written_at FROM manuscripts "
+                "UNION ALL SELECT session_id, recorded_at FROM takes"
+                ") GROUP BY session_id HAVING MAX(written_at) < ?", (cutoff,))]
+            for table in ("takes", "manuscripts"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE session_id = ?", [(i,) for i in session_ids])
+        return session_ids
+
+    def recorded(self, session_id):
+        """Yields {"text", "file_name"} of every take, in manuscript order."""
+        for text, file_name in self._stream(
+                "SELECT text, file_name FROM takes WHERE session_id = ? ORDER BY manuscript_index", (session_id,)):
+            yield {"text": text, "file_name": file_name}
+
+    def unrecorded(self, session_id):
+        """Yields the manuscripts without a take of the same text."""
+        for (text,) in self._stream(
+                "SELECT m.text FROM manuscripts m LEFT JOIN takes t "
+                "ON t.session_id = m.session_id AND t.manuscript_index = m.manuscript_index AND t.text = m.text "
+                "WHERE m.session_id = ? AND t.session_id IS NULL ORDER BY m.manuscript_index", (session_id,)):
+            yield text
+
+@st.cache_resource
+def get_record_store():
+    return RecordStore(settings.record_db_path)
+
+@st.cache_resource(ttl=3600)
+def cleanup_old_sessions():
+    """Remove sessions untouched for `session_max_age_hours`: their directories and their rows. Runs at most hourly."""
+    if settings.session_max_age_hours <= 0 or not settings.wav_dir_path.is_dir():
+        return 0
+    cutoff = time.time() - settings.session_max_age_hours * 3600
+    # 録音しなかったセッションはディレクトリが無く、原稿の行だけが残るので DB 側も年齢で消す
+    removed = set(get_record_store().delete_sessions_before(cutoff))
+    for session_dir in settings.wav_dir_path.iterdir():
+        # セッションのディレクトリは uuid4().hex の名前
+        if not (session_dir.is_dir() and len(session_dir.name) == 32):
+            continue
+        try:
+            if session_dir.stat().st_mtime >= cutoff:
+                continue
+            shutil.rmtree(session_dir)
+        except OSError as e:
+            print(f"cleanup_old_sessions: {session_dir} ({e!r})")
+            continue
+        get_record_store().delete_session(session_dir.name)
+        removed.add(session_dir.name)
+    if removed:
+        print(f"cleanup_old_sessions: removed {len(removed)} sessions older than {settings.session_max_age_hours}h")
+    return len(removed)
 
 @dataclass
 class RecordStrage:
+    """One session's takes: a handle on the shared RecordStore plus the session's archive."""
+    store: RecordStore
+    session_id: str
+    session_dir: Path  # created by prepare_session_dir() on the first take
+    archive: Optional["IncrementalArchive"] = None
     all_manuscripts: List[str] = field(default_factory=list)
-    id2record: Dict[int, Record] = field(default_factory=dict)
 
     @property
     def num_wav_files(self):
-        return len(self.id2record)
+        return self.store.num_takes(self.session_id)
+
+    def prepare_session_dir(self) -> None:
+        """Create the session directory and its archive, unless that was done already."""
+        if self.archive is None:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            self.archive = IncrementalArchive(self.session_dir / settings.archive_filename)
+
+    def set_manuscripts(self, texts) -> None:
+        if texts != self.all_manuscripts:
+            self.all_manuscripts = texts
+            self.store.set_manuscripts(self.session_id, texts)
 
     def export_record_info_as_json(self, record_info_path) -> None:
+        # 1 件ずつ書き出す (全件をメモリに載せない)
         with record_info_path.open("w") as f:
-            json.dump(
-                [record.record_info for _, record in self.id2record.items()],
-                f,
-                ensure_ascii=False,
-                indent=4,
-            )
+            f.write("[")
+            for i, record_info in enumerate(self.store.recorded(self.session_id)):
+                f.write(",\n    " if i else "\n    ")
+                f.write(json.dumps(record_info, ensure_ascii=False))
+            f.write("\n]\n")
 
     def export_unrecorded_texts_as_json(self, unrecorded_textx_path) -> None:
         if unrecorded_textx_path.exists():
             unrecorded_textx_path.unlink()
 
-        recorded_indexes = set([record.manuscript_index for _, record in self.id2record.items()])
-        results = []
-        for i, text in enumerate(self.all_manuscripts):
-            if i not in recorded_indexes:
-                results.append(text)
-
-        if results:
-            with unrecorded_textx_path.open("w") as f:
-                for text in results:
-                    f.write(text + "\n")
-
-    def compress_wav_files_into_zip(self, archive_filename, wav_dir_path):
-        with zipfile.ZipFile(archive_filename, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
-            for file_path in wav_dir_path.rglob("*"):
-                archive.write(file_path, arcname=file_path.relative_to(wav_dir_path))
+        f = None
+        for text in self.store.unrecorded(self.session_id):
+            if f is None:
+                f = unrecorded_textx_path.open("w")
+            f.write(text + "\n")
+        if f is not None:
+            f.close()
+
+    def add_take(self, record) -> None:
+        """Upsert a saved take and append it to the archive (a re-take replaces the old entry)."""
+        stored_file_path = record.stored_file_path
+        self.store.upsert_take(self.session_id, record, stored_file_path)
+        if self.archive is not None:
+            for _, suffix, _ in STORAGE_FORMATS.values():
+                if suffix != stored_file_path.suffix:
+                    self.archive.discard(record.wav_file_path.with_suffix(suffix).name)
+            self.archive.add(stored_file_path.name, stored_file_path)
+
+    def storage_stats(self):
+        return self.store.storage_stats(self.session_id)
 
 ###############################
 # util
@@ -207,14 +506,44 @@ class Counter:
         else:
             return 0.0
 
+###############################
+# audio_buffer
+###############################
+from asr_common import STORAGE_FORMATS, stored_audio_path, write_audio
+
 ###############################
 # webrtc
 ###############################
-import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import pydub
 import streamlit as st
-from streamlit_webrtc import WebRtcMode, webrtc_streamer
+from streamlit_webrtc import WebRtcMode, create_audio_sink_track, webrtc_streamer
+
+from asr_common import (FrameRecorder, ThrottledUpdater, get_recording_memory, recording_memory_sidebar,
+                        trim_take)
+
+@st.cache_resource
+def get_audio_encoder():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-encoder")
+
+def encode_take(records, record, samples, sample_rate, codec):
+    """Runs on the encoder thread: store the take as `codec`, then swap it into the archive."""
+    encoder, suffix, _ = STORAGE_FORMATS[codec]
+    file_path = record.wav_file_path.with_suffix(suffix)
+    # 書き終わるまでは WAV の方が再生される
+    tmp_path = file_path.with_suffix(".tmp" + suffix)
+    try:
+        write_audio(tmp_path, samples, sample_rate, encoder)
+        tmp_path.replace(file_path)
+        record.wav_file_path.unlink(missing_ok=True)
+        records.add_take(record)
+    except Exception as e:
+        print(f"encode_take: {record.output_wav_name} failed ({e!r}), keeping the WAV")
+        tmp_path.unlink(missing_ok=True)
+        records.add_take(record)
+        return
+    print(f"encode_take: {file_path.name} {file_path.stat().st_size} Byte ({file_path.stat().st_size / record.wav_bytes:.0%} of WAV)")
 
 class WebRTCRecord:
     def __init__(self):
@@ -228,66 +557,71 @@ class WebRTCRecord:
         # グローバルネットワークにあるSTUNサーバへの問い合わせが必要になります。
         # 上記サンプルでは、Googleが公開していてフリーで利用できるSTUNサーバを利用するよう設定しました。
         # 有効なSTUNサーバであればこれ以外を設定しても大丈夫です
+        if "frame_recorder" not in st.session_state:
+            st.session_state["frame_recorder"] = FrameRecorder(
+                ram_budget=int(settings.buffer_ram_mb * 1024 * 1024), max_seconds=settings.max_take_seconds,
+                tracker=get_recording_memory(), spill_dir=settings.buffer_spill_dir)
+            print("WebRTCRecord:init set frame_recorder")
+        self.recorder = st.session_state["frame_recorder"]
+
+        # フレームは WebRTC のイベントループから recorder に渡され、recorder の drain スレッドで溜められる
         self.webrtc_ctx = webrtc_streamer(
             key="sendonly-audio",
             mode=WebRtcMode.SENDONLY,
-            audio_receiver_size=256,
+            sink_audio_track=create_audio_sink_track(
+                self.recorder.on_frame, key="sendonly-audio-sink", on_ended=self.recorder.on_ended),
             rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
             media_stream_constraints={
                 "audio": True,
             },
         )
 
-        if "audio_buffer" not in st.session_state:
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
-            print("WebRTCRecord:init set audio_buffer")
-
     def recording(self, record):
         status_box = st.empty()
+        recorder = self.recorder
+        recorder.set_playing(self.webrtc_ctx.state.playing)
+        # 変わった値だけを、ui_max_fps を超えない頻度でブラウザに送る
+        status = ThrottledUpdater(status_box, max_fps=settings.ui_max_fps)
 
         print("WebRTCRecord:recording")
-        while True:
-            if self.webrtc_ctx.audio_receiver:
-                print("Recording Try get_frames...")
-                try:
-                    audio_frames = self.webrtc_ctx.audio_receiver.get_frames(timeout=1)
-                except queue.Empty:
-                    status_box.warning("No frame arrived.")
-                    print("No frame arrived.")
-                    continue
-
-                status_box.info("Now Recording...")
-                print("Now Recording.....")
-
-                sound_chunk = pydub.AudioSegment.empty()
-                for audio_frame in audio_frames:
-                    sound = pydub.AudioSegment(
-                        data=audio_frame.to_ndarray().tobytes(),
-                        sample_width=audio_frame.format.bytes,
-                        frame_rate=audio_frame.sample_rate,
-                        channels=len(audio_frame.layout.channels),
-                    )
-                    sound_chunk += sound
-
-                if len(sound_chunk) > 0:
-                    st.session_state["audio_buffer"] += sound_chunk
-            else:
-                break
-
-        audio_buffer = st.session_state["audio_buffer"]
-
-        if not self.webrtc_ctx.state.playing and len(audio_buffer) > 0:
+        last_frames = -1
+        last_frame_at = time.monotonic()
+        while self.webrtc_ctx.state.playing and not recorder.track_ended:
+            if recorder.frames != last_frames:
+                last_frames = recorder.frames
+                last_frame_at = time.monotonic()
+                if recorder.buffer.truncated:
+                    status.update("warning", f"最大録音時間 ({settings.max_take_seconds:.0f}秒) に達しました。録音を止めてください。")
+                else:
+                    status.update("info", f"Now Recording... ({recorder.duration:.0f}s)")
+            elif time.monotonic() - last_frame_at > 1:
+                status.update("warning", "No frame arrived.")
+                print("No frame arrived.")
+                last_frame_at = time.monotonic()
+            time.sleep(status.min_interval or 0.2)
+        status.flush()
+
+        if not self.webrtc_ctx.state.playing and len(recorder) > 0:
             status_box.success("Finish Recording")
             print("Finish Recording")
+            audio_buffer, _ = recorder.take()
+            trim_take(audio_buffer, threshold_db=settings.trim_threshold_db, pad_ms=settings.trim_pad_ms)
+            records = st.session_state["records"]
             try:
-                st.session_state["records"].id2record[record.output_wav_name] = record
-                audio_buffer.export(str(record.wav_file_path), format="wav")
+                records.prepare_session_dir()
+                audio_buffer.export_wav(record.wav_file_path)
+                record.wav_bytes = record.wav_file_path.stat().st_size
+                if settings.storage_codec == "wav":
+                    records.add_take(record)
+                else:
+                    # エンコードが終わるまでは WAV として登録しておく
+                    records.store.upsert_take(records.session_id, record, record.wav_file_path)
+                    get_audio_encoder().submit(
+                        encode_take, records, record, audio_buffer.samples, audio_buffer.sample_rate,
+                        settings.storage_codec)
             except BaseException:
                 st.error("Error while Writing wav to disk")
 
-            # Reset
-            st.session_state["audio_buffer"] = pydub.AudioSegment.empty()
-
 
 ###############################
 # Main
@@ -298,12 +632,15 @@ def initialize_startup():
     if "counter" not in st.session_state:
         st.session_state["counter"] = Counter()
     if "records" not in st.session_state:
-        st.session_state["records"] = RecordStrage()
-
-        # initialize wav dir
-        if settings.wav_dir_path.exists():
-            shutil.rmtree(settings.wav_dir_path)
-        settings.wav_dir_path.mkdir()
+        # 古いセッションの片付け (1 時間に 1 度まで)
+        cleanup_old_sessions()
+        # セッションごとのディレクトリ (他のセッションの録音は消さない)。最初の録音の時に作る
+        session_id = uuid.uuid4().hex
+        st.session_state["records"] = RecordStrage(
+            store=get_record_store(),
+            session_id=session_id,
+            session_dir=settings.wav_dir_path / session_id,
+        )
 
 
 def main():
@@ -318,11 +655,12 @@ def main():
     if ui_sidebar.has_at_least_one_wav_file():
         ui_sidebar.progress_bar_and_stats()
         ui_sidebar.proceed_to_download(settings)
+    ui_sidebar.recording_memory_stats()
 
     # Main Window (only visible when manuscript is in the text area)
     if st.session_state["manuscripts"]:
         texts = [t for t in st.session_state["manuscripts"].split("\n") if t]
-        st.session_state["records"].all_manuscripts = texts
+        st.session_state["records"].set_manuscripts(texts)
 
         if st.session_state["counter"].total is None:
             st.session_state["counter"].set_total(len(texts))
@@ -330,7 +668,7 @@ def main():
         record = Record(
             manuscript_index=st.session_state["counter"].index,
             text=texts[st.session_state["counter"].index],
-            wav_dir_path=settings.wav_dir_path,
+            wav_dir_path=st.session_state["records"].session_dir,
         )
 
         ui_main.manuscript_view(record.text)